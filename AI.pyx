@@ -1,12 +1,21 @@
-import os
-import sys
+import atexit
+import multiprocessing
+import threading
+import time
 import timeit
 from random import randint
 
 import chess
-import chess.pgn
 from chess import polyglot
 
+from Evaluation import MaterialEvaluator, BatchEvaluator, PIECE_VALUES
+from GameIndex import getIndex
+from OpeningBook import getBook, BOOK_PATH
+from Position import fromBoard, toMove, NULL_MOVE, PAWN, KING, PIECE_MASK, FIVEFOLD_PLIES
+from SearchStats import SearchStats
+from Tablebase import getTablebase
+from TranspositionTable import TranspositionTable, SharedTranspositionTable, EXACT, LOWERBOUND, UPPERBOUND, DEPTH, SCORE, BOUND, MOVE
+
 
 class RandomAI:
     def __init__(self, board):
@@ -24,95 +33,864 @@ class RandomAI:
         return chess.Move.null()
 
 
+class SearchAborted(Exception):
+    # raised inside the search when the time/node budget runs out or stop() is called
+    pass
+
+
+# process pools of the parallel root search, one per worker count, kept for
+# the life of the process so that a move does not fork new workers
+_pools = {}
+# inside a pool worker: the stop event and the node counter shared with the
+# parent, and one engine per option set so that worker transposition tables
+# stay warm between moves
+_workerStop = None
+_workerNodes = None
+_workerEngines = {}
+
+
+def _initWorker(stopEvent, nodeCounter):
+    global _workerStop, _workerNodes
+    _workerStop = stopEvent
+    _workerNodes = nodeCounter
+
+
+def getPool(workers):
+    # (pool, stop event, node counter) for this many workers
+    if workers not in _pools:
+        stopEvent = multiprocessing.Event()
+        nodeCounter = multiprocessing.Value('l', 0)
+        pool = multiprocessing.Pool(workers, _initWorker, (stopEvent, nodeCounter))
+        _pools[workers] = (pool, stopEvent, nodeCounter)
+    return _pools[workers]
+
+
+def closePools():
+    for pool, stopEvent, nodeCounter in _pools.values():
+        pool.terminate()
+        pool.join()
+    _pools.clear()
+
+
+atexit.register(closePools)
+
+
+def _searchRootMove(task):
+    # runs in a pool worker: null-window score of one root move against
+    # alpha, or None if the search was stopped or ran out of budget first.
+    # nodeLimit is the budget of the whole search, counted in _workerNodes
+    player, options, board, move, ply, alpha, deadline, nodeLimit = task
+    if _workerStop.is_set() or (deadline is not None and time.time() >= deadline):
+        return None, 0
+    key = (player, tuple(sorted(options.items())))
+    engine = _workerEngines.get(key)
+    if engine is None:
+        engine = _workerEngines[key] = AI(board, player, **options)
+    engine.board = board
+    engine.nodeLimit = None
+    engine.stopEvent = _workerStop
+    engine.startSearch(board, None if deadline is None else max(0.0, deadline - time.time()))
+    engine.sharedBudget = None if nodeLimit is None else (_workerNodes, nodeLimit)
+    try:
+        score = engine.searchMove(engine.position, move, ply, alpha, alpha + 1)
+    except SearchAborted:
+        return None, engine.nodes
+    finally:
+        engine.sharedBudget = None
+    return score, engine.nodes
+
+
 class AI:
-    MIN_INT = - sys.maxint - 1
-    MAX_INT = sys.maxint
-    PIECE_SCORES = [0, 1, 2, 3, 4, 5, 6]
-    PIECE_SCORES[chess.PAWN] = 10
-    PIECE_SCORES[chess.KNIGHT] = 30
-    PIECE_SCORES[chess.BISHOP] = 30
-    PIECE_SCORES[chess.ROOK] = 50
-    PIECE_SCORES[chess.QUEEN] = 90
-    PIECE_SCORES[chess.KING] = 2000
-
-    def __init__(self, board, player, ply=4):
+    PIECE_SCORES = PIECE_VALUES
+    # score of a won game, and a bound no score reaches
+    WIN_SCORE = 2000
+    INFINITE = 10 * WIN_SCORE
+    # aspiration: from the second iteration on the root is searched in a
+    # window of ASPIRATION_WINDOW around the previous score, widened
+    # ASPIRATION_GROWTH times whenever the score falls outside it
+    ASPIRATION_WINDOW = 5
+    ASPIRATION_GROWTH = 4
+    # deepest iteration of a time or node managed search
+    MAX_PLY = 64
+    # nodes searched between two looks at the clock
+    CHECK_INTERVAL = 64
+    # move ordering: hash move, then captures/promotions by MVV-LVA,
+    # then the two killers of the ply, then quiet moves by history score.
+    # Moves are sorted as order << MOVE_BITS | move
+    HASH_MOVE_ORDER = 1 << 30
+    CAPTURE_ORDER = 1 << 28
+    KILLER_ORDER = (1 << 27, (1 << 27) - 1)
+    MOVE_BITS = 15
+    MOVE_MASK = (1 << MOVE_BITS) - 1
+    # quiescence: a capture that cannot lift the score to within DELTA_MARGIN
+    # of the window is skipped, and one horizon leaf may spend at most
+    # QUIESCENCE_NODES nodes resolving captures
+    DELTA_MARGIN = 20
+    QUIESCENCE_NODES = 2000
+    # selective search.  Null move: with NULL_MOVE_MIN_PLY or more plies to
+    # go, passing is searched NULL_MOVE_REDUCTION plies shallower and a
+    # score still at or above beta cuts the node off.  Late move reductions:
+    # quiet moves after the first LMR_MIN_MOVES are searched one ply
+    # shallower with LMR_MIN_PLY or more plies to go.  Futility: one ply
+    # from the horizon, quiet moves are skipped when the static score is
+    # FUTILITY_MARGIN or more below alpha
+    NULL_MOVE_MIN_PLY = 3
+    NULL_MOVE_REDUCTION = 2
+    LMR_MIN_PLY = 3
+    LMR_MIN_MOVES = 3
+    FUTILITY_MARGIN = 20
+    # score of a position the endgame tablebases call won, below a checkmate
+    TABLEBASE_WIN = WIN_SCORE // 2
+
+    def __init__(self, board, player, ply=4, hashSize=16, moveTime=None, nodeLimit=None,
+                 pieceSquareTables=False, quiescence=True, threads=1,
+                 bookPath=BOOK_PATH, bookDepth=None, bookSelection='weighted', stats=False,
+                 nullMove=True, lateMoveReductions=True, futilityPruning=True,
+                 tablebasePath=None, tablebasePieces=5, batchEvaluation=False, indexPath=None,
+                 ttPath=None):
         self.board = board
         self.player = player
         self.ply = ply - 1
-        if self.board.fen() == chess.STARTING_FEN:
-            self.GetNextMove = self.getOpening
+        # settings a pool worker needs to build an identical engine
+        self.workerOptions = {'hashSize': hashSize,
+                              'pieceSquareTables': pieceSquareTables,
+                              'quiescence': quiescence,
+                              'nullMove': nullMove,
+                              'lateMoveReductions': lateMoveReductions,
+                              'futilityPruning': futilityPruning,
+                              'tablebasePath': tablebasePath,
+                              'tablebasePieces': tablebasePieces,
+                              'batchEvaluation': batchEvaluation,
+                              'ttPath': ttPath}
+        # with more than one thread the root moves are searched in a process pool
+        self.threads = threads
+        self.stopEvent = None
+        # the search runs on a Position built from the board when it starts
+        self.position = None
+        # follows every move made during the search so leaves score in O(1).
+        # With batchEvaluation (needs numpy) the horizon leaves are scored
+        # together, all the children of a node in one batch; leafScore is
+        # the batch score of the leaf about to be searched
+        self.evaluator = (BatchEvaluator if batchEvaluation else MaterialEvaluator)(pieceSquareTables)
+        self.batchEvaluation = batchEvaluation
+        self.leafScore = None
+        # transposition table, hashSize in megabytes; it keeps moves packed.
+        # With ttPath it lives in that file, shared with the other engine
+        # processes that use it and kept for the next ones
+        if ttPath:
+            signature = repr((PIECE_VALUES, self.evaluator.pst, AI.WIN_SCORE, AI.TABLEBASE_WIN))
+            self.tt = SharedTranspositionTable(ttPath, hashSize, signature)
+        else:
+            self.tt = TranspositionTable(hashSize)
+        # resolve captures at the horizon instead of scoring mid-exchange
+        self.quiescence = quiescence
+        self.quiescenceBudget = 0
+        # selective search, each can be turned off to measure what it saves
+        self.nullMove = nullMove
+        self.lateMoveReductions = lateMoveReductions
+        self.futilityPruning = futilityPruning
+        # per move budget: moveTime in seconds and/or nodeLimit in nodes.
+        # With neither set the search goes to a fixed depth of ply, and with
+        # fixedDepth it also stops there when they are set
+        self.moveTime = moveTime
+        self.nodeLimit = nodeLimit
+        self.fixedDepth = False
+        # (counter, limit) while the node budget is shared with pool
+        # workers, and how many of this engine's nodes are in the counter
+        self.sharedBudget = None
+        self.nodesShared = 0
+        self.nodes = 0
+        self.depthReached = 0
+        self.stopped = False
+        # called as infoCallback(depth, score, nodes, seconds) after every
+        # finished iteration, e.g. to report the progress of the search
+        self.infoCallback = None
+        # optional SearchStats of the last move; pool workers do not collect
+        # any, so with threads > 1 they cover the root only
+        self.stats = SearchStats() if stats else None
+        # killers[height] holds two quiet moves that caused a cutoff at that
+        # distance from the root; history[color][from + to * 64] scores quiet
+        # moves by the cutoffs they produced anywhere in the tree
+        self.killers = [[NULL_MOVE, NULL_MOVE] for i in range(AI.MAX_PLY + 1)]
+        self.history = [[0] * 4096, [0] * 4096]
+        # opening book, consulted on every move until the game leaves it or
+        # passes bookDepth plies; bookSelection is 'weighted' or 'best'.
+        # With indexPath the moves come from a GameIndex of PGN games instead
+        if indexPath:
+            self.book = getIndex(indexPath)
         else:
-            self.GetNextMove = self.getMinimaxMove
+            self.book = getBook(bookPath) if bookPath else None
+        self.bookDepth = bookDepth
+        self.bookSelection = bookSelection
+        self.inBook = self.book is not None
+        # optional Syzygy tablebases: with tablebasePieces or fewer pieces on
+        # the board the root move comes from the tables, and the search
+        # scores such positions without searching them
+        self.tablebase = getTablebase(tablebasePath) if tablebasePath else None
+        self.tablebasePieces = tablebasePieces
+        # pondering: the opponent's predicted reply is searched in a background
+        # thread while the opponent thinks
+        self.ponderThread = None
+        self.ponderMove = None
+        self.ponderResult = None
+        # a finished ponder search to play at once, or seconds already spent on
+        # the position by an unfinished one
+        self.ponderReply = None
+        self.ponderCredit = 0.0
+
+    def GetNextMove(self):
+        if self.ponderReply is not None:
+            move = self.ponderReply
+            self.ponderReply = None
+            if move in self.board.legal_moves:
+                return move
+        move = self.getOpening()
+        if move is None:
+            move = self.getTablebaseMove()
+        if move is None:
+            move = self.getMinimaxMove()
+        return move
 
     def getOpening(self):
-        path = os.path.join('data', 'komodo.bin')
-        reader = polyglot.MemoryMappedReader(path)
-        self.GetNextMove = self.getMinimaxMove
-        return reader.weighted_choice(self.board).move()
+        # book move for the current position, or None once the game is out of the book
+        if not self.inBook:
+            return None
+        board = self.board
+        ply = (board.fullmove_number - 1) * 2 + (board.turn == chess.BLACK)
+        if self.bookDepth is not None and ply >= self.bookDepth:
+            self.inBook = False
+            return None
+        move = self.book.choose(board, self.bookSelection)
+        if move is None:
+            self.inBook = False
+        return move
+
+    def getTablebaseMove(self):
+        # tablebase move for the current position, or None if it is not in the tables
+        if self.tablebase is None or not self.tablebase.covers(self.board, self.tablebasePieces):
+            return None
+        return self.tablebase.rootMove(self.board)
 
     def getMinimaxMove(self):
-        bestMove = chess.Move.null()
-        bestScore = AI.MIN_INT
-
-        for move in self.board.legal_moves:
-            self.board.push(move)
-            score = self.minimax(self.board, self.ply, AI.MIN_INT, AI.MAX_INT)
-            self.board.pop()
-            if bestScore <= score:
+        moveTime = self.moveTime
+        if moveTime is not None:
+            moveTime = max(0.0, moveTime - self.ponderCredit)
+        self.ponderCredit = 0.0
+        self.startSearch(self.board, moveTime)
+        return self.iterativeDeepening(self.board, 1, self.lastDepth())
+
+    def lastDepth(self):
+        if self.fixedDepth or (self.moveTime is None and self.nodeLimit is None):
+            # the shallow iterations are cheap and fill the table with hash moves
+            return self.ply + 1
+        return AI.MAX_PLY
+
+    def startSearch(self, board, moveTime=None):
+        self.tt.newSearch()
+        self.tt.setPlayer(self.player)
+        self.nodes = 0
+        self.nodesShared = 0
+        self.depthReached = 0
+        self.stopped = False
+        self.startTime = timeit.default_timer()
+        self.deadline = None if moveTime is None else self.startTime + moveTime
+        self.checkNodes = AI.CHECK_INTERVAL
+        if self.nodeLimit is not None:
+            self.checkNodes = min(self.checkNodes, self.nodeLimit)
+        self.rootBoard = board
+        self.position = fromBoard(board)
+        self.evaluator.reset(self.position)
+        self.leafScore = None
+        if self.stats is not None:
+            self.stats.reset(board.fen(), self.tt.stats())
+        self.killers = [[NULL_MOVE, NULL_MOVE] for i in range(AI.MAX_PLY + 1)]
+        # history from the previous move still helps, but should not dominate
+        for table in self.history:
+            for i in range(4096):
+                table[i] >>= 2
+
+    def stop(self):
+        # may be called from another thread; the search notices at its next check
+        self.stopped = True
+
+    def checkLimits(self):
+        if self.stopped:
+            raise SearchAborted()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchAborted()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchAborted()
+        if self.sharedBudget is not None:
+            # the nodes of every process searching the move count together
+            counter, limit = self.sharedBudget
+            with counter.get_lock():
+                counter.value += self.nodes - self.nodesShared
+                total = counter.value
+            self.nodesShared = self.nodes
+            if total >= limit:
+                raise SearchAborted()
+        if self.deadline is not None and timeit.default_timer() >= self.deadline:
+            raise SearchAborted()
+        self.checkNodes = self.nodes + AI.CHECK_INTERVAL
+        if self.nodeLimit is not None:
+            self.checkNodes = min(self.checkNodes, self.nodeLimit)
+
+    def makeMove(self, position, mv):
+        self.evaluator.push(position, mv)
+        position.makeMove(mv)
+
+    def unmakeMove(self, position):
+        position.unmakeMove()
+        self.evaluator.pop()
+
+    def orderMoves(self, position, moves, hashMove, height):
+        # returns the packed moves, most promising first
+        killers = self.killers[height]
+        history = self.history[position.turn]
+        squares = position.squares
+        epSquare = position.ep
+        scored = []
+
+        for mv in moves:
+            if mv == hashMove:
+                order = AI.HASH_MOVE_ORDER
+            else:
+                toSquare = mv >> 6 & 63
+                attacker = squares[mv & 63] & PIECE_MASK
+                victim = squares[toSquare] & PIECE_MASK
+                if not victim and toSquare == epSquare and attacker == PAWN and epSquare:
+                    victim = PAWN
+                if victim:
+                    # most valuable victim, least valuable attacker
+                    order = AI.CAPTURE_ORDER + 8 * victim - attacker
+                elif mv >> 12:
+                    order = AI.CAPTURE_ORDER + 8 * (mv >> 12)
+                elif mv == killers[0]:
+                    order = AI.KILLER_ORDER[0]
+                elif mv == killers[1]:
+                    order = AI.KILLER_ORDER[1]
+                else:
+                    order = history[mv & 4095]
+            scored.append(order << AI.MOVE_BITS | mv)
+
+        scored.sort(reverse=True)
+        mask = AI.MOVE_MASK
+        return [item & mask for item in scored]
+
+    def recordCutoff(self, position, mv, ply, height):
+        # remember a quiet move that refuted the position
+        if mv >> 12 or position.isCapture(mv):
+            return
+        killers = self.killers[height]
+        if killers[0] != mv:
+            killers[1] = killers[0]
+            killers[0] = mv
+        self.history[position.turn][mv & 4095] += ply * ply
+
+    def iterativeDeepening(self, board, firstDepth, lastDepth):
+        # deepen one ply at a time and keep the move of the last finished
+        # iteration; board is the position startSearch() was given
+        position = self.position
+        bestMove = None
+        bestScore = None
+        for depth in range(firstDepth, lastDepth + 1):
+            try:
+                bestMove, bestScore = self.searchAspirated(position, depth - 1, bestScore)
+            except SearchAborted:
+                # unwind the moves the interrupted search left on the position
+                while position.ply:
+                    position.unmakeMove()
+                self.evaluator.reset(position)
+                break
+            self.depthReached = depth
+            if self.stats is not None:
+                self.stats.endIteration(depth, self.nodes)
+            if self.infoCallback is not None:
+                self.infoCallback(depth, bestScore, self.nodes, timeit.default_timer() - self.startTime)
+            if board.legal_moves.count() <= 1:
+                break
+            # an iteration takes several times longer than the previous one,
+            # so do not start one that cannot finish
+            if self.deadline is not None and \
+                    timeit.default_timer() - self.startTime > (self.deadline - self.startTime) / 2.0:
+                break
+
+        if bestMove is None:
+            # not even the first iteration finished, take the best root move found so far
+            bestMove = self.rootBestMove
+        bestMove = toMove(bestMove)
+        if bestMove == chess.Move.null():
+            for bestMove in board.legal_moves:
+                break
+        if self.stats is not None:
+            self.stats.finish(bestMove, self.nodes, self.tt.stats())
+        return bestMove
+
+    def principalVariation(self, board, length=MAX_PLY):
+        # the expected line of play from board, read from the transposition table
+        board = board.copy()
+        seen = set()
+        pv = []
+        while len(pv) < length:
+            key = polyglot.zobrist_hash(board)
+            if key in seen:
+                break
+            seen.add(key)
+            entry = self.tt.probe(key)
+            if entry is None or entry[MOVE] is None:
+                break
+            move = toMove(entry[MOVE])
+            if move not in board.legal_moves:
+                break
+            pv.append(move)
+            board.push(move)
+        return pv
+
+    def startPondering(self):
+        # guess the opponent's reply from the table and search the position
+        # after it on a copy of the board; returns False if there is no guess
+        board = self.board.copy()
+        entry = self.tt.probe(polyglot.zobrist_hash(board))
+        if entry is None or entry[MOVE] is None or toMove(entry[MOVE]) not in board.legal_moves:
+            return False
+        self.ponderMove = toMove(entry[MOVE])
+        self.ponderResult = None
+        self.ponderReply = None
+        self.ponderCredit = 0.0
+        board.push(self.ponderMove)
+        self.ponderStart = timeit.default_timer()
+        # set up here rather than in the thread, so that an early stop() is not lost
+        self.startSearch(board)
+        self.ponderThread = threading.Thread(target=self.ponder, args=(board,))
+        self.ponderThread.daemon = True
+        self.ponderThread.start()
+        return True
+
+    def ponder(self, board):
+        # runs in the ponder thread, without a deadline, until it finishes or
+        # stopPondering stops it
+        move = self.iterativeDeepening(board, 1, self.lastDepth())
+        if self.depthReached > 0:
+            self.ponderResult = move
+
+    def stopPondering(self, move):
+        # called with the opponent's actual move before it is pushed
+        if self.ponderThread is None:
+            return
+        hit = move == self.ponderMove
+        fixedDepth = self.moveTime is None and self.nodeLimit is None
+        if not (hit and fixedDepth):
+            self.stop()
+        # on a fixed-depth hit the ponder search simply finishes its depth
+        self.ponderThread.join()
+        self.ponderThread = None
+        elapsed = timeit.default_timer() - self.ponderStart
+
+        if hit and self.ponderResult is not None:
+            if fixedDepth or (self.moveTime is not None and elapsed >= self.moveTime):
+                self.ponderReply = self.ponderResult
+            elif self.moveTime is not None:
+                # the next search only needs the rest of the move time
+                self.ponderCredit = elapsed
+        # on a miss the ponder search has still filled the transposition table
+
+    def searchAspirated(self, position, ply, guess):
+        # root search in a narrow window around guess, the previous iteration's
+        # score, repeated with a wider window while the score falls outside it
+        if guess is None:
+            return self.searchRoot(position, ply, -AI.INFINITE, AI.INFINITE)
+        delta = AI.ASPIRATION_WINDOW
+        alpha = max(guess - delta, -AI.INFINITE)
+        beta = min(guess + delta, AI.INFINITE)
+        while True:
+            bestMove, bestScore = self.searchRoot(position, ply, alpha, beta)
+            delta *= AI.ASPIRATION_GROWTH
+            if bestScore <= alpha and alpha > -AI.INFINITE:
+                alpha = max(bestScore - delta, -AI.INFINITE)
+            elif bestScore >= beta and beta < AI.INFINITE:
+                beta = min(bestScore + delta, AI.INFINITE)
+            else:
+                return bestMove, bestScore
+
+    def searchRoot(self, position, ply, alpha, beta):
+        # principal variation search of the root, scores from self.player's
+        # point of view (the side to move); returns a packed move
+        if self.threads > 1:
+            return self.searchRootParallel(position, ply, alpha, beta)
+
+        alphaOrig = alpha
+        bestMove = NULL_MOVE
+        bestScore = -AI.INFINITE
+        self.rootBestMove = bestMove
+        key = position.key
+        entry = self.tt.probe(key)
+        hashMove = entry[MOVE] if entry is not None else None
+
+        for move in self.orderMoves(position, position.legalMoves(), hashMove, 0):
+            self.makeMove(position, move)
+            if bestMove == NULL_MOVE:
+                score = -self.negamax(position, ply, -beta, -alpha)
+            else:
+                score = -self.negamax(position, ply, -alpha - 1, -alpha)
+                if alpha < score < beta:
+                    score = -self.negamax(position, ply, -beta, -alpha)
+            self.unmakeMove(position)
+            if score > bestScore:
                 bestMove = move
                 bestScore = score
+                self.rootBestMove = bestMove
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
 
-        return bestMove
+        # the next iteration searches this move first
+        if bestScore <= alphaOrig:
+            bound = UPPERBOUND
+        elif bestScore >= beta:
+            bound = LOWERBOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, ply + 1, bestScore, bound, bestMove)
+        return bestMove, bestScore
 
-    def minimax(self, board, ply, alpha, beta):
-        maxplayer = board.turn == self.player
+    def searchRootParallel(self, position, ply, alpha, beta):
+        # principal variation search of the root with the later moves spread
+        # over a process pool: the first move is searched here and sets
+        # alpha, the workers test the others with a null window at that
+        # alpha, and the moves that fail high are searched again here with
+        # the full window.  The moves keep the sequential order so ties
+        # resolve the same way, and one node budget covers all processes
+        self.checkLimits()
+        pool, stopEvent, nodeCounter = getPool(self.threads)
+        stopEvent.clear()
+        alphaOrig = alpha
+        key = position.key
+        entry = self.tt.probe(key)
+        hashMove = entry[MOVE] if entry is not None else None
+        moves = self.orderMoves(position, position.legalMoves(), hashMove, 0)
 
-        if ply == 0 or board.is_game_over():
-            return self.heuristic(board)
+        self.rootBestMove = NULL_MOVE
+        bestMove = moves[0]
+        bestScore = self.searchMove(position, bestMove, ply, alpha, beta)
+        self.rootBestMove = bestMove
+        alpha = max(alpha, bestScore)
+
+        if alpha < beta and len(moves) > 1:
+            # workers run on the wall clock, so pass the deadline as an epoch time
+            deadline = None
+            if self.deadline is not None:
+                deadline = time.time() + self.deadline - timeit.default_timer()
+            # workers get the board with its history, for repetitions
+            workerAlpha = alpha
+            tasks = [(self.player, self.workerOptions, self.rootBoard, move, ply, workerAlpha, deadline,
+                      self.nodeLimit) for move in moves[1:]]
+            with nodeCounter.get_lock():
+                nodeCounter.value = self.nodes
+            self.nodesShared = self.nodes
+            if self.nodeLimit is not None:
+                self.sharedBudget = (nodeCounter, self.nodeLimit)
+            results = pool.imap(_searchRootMove, tasks)
+            try:
+                for move in moves[1:]:
+                    score, nodes = self.nextResult(results, stopEvent)
+                    # the worker's nodes are in the counter already
+                    self.nodes += nodes
+                    self.nodesShared += nodes
+                    if score is None:
+                        raise SearchAborted()
+                    if workerAlpha < score < beta:
+                        # only known to be at least score: search it properly
+                        score = self.searchMove(position, move, ply, alpha, beta)
+                    if score > bestScore:
+                        bestMove = move
+                        bestScore = score
+                        self.rootBestMove = bestMove
+                        if score > alpha:
+                            alpha = score
+                            if alpha >= beta:
+                                break
+            finally:
+                self.sharedBudget = None
+                # after a cutoff or an abort the remaining tasks are only
+                # waited for, they return as soon as they see the event
+                stopEvent.set()
+                for result in results:
+                    pass
+
+        if bestScore <= alphaOrig:
+            bound = UPPERBOUND
+        elif bestScore >= beta:
+            bound = LOWERBOUND
         else:
-            bestScore = AI.MIN_INT if maxplayer else AI.MAX_INT
-            compare = max if maxplayer else min
-            minimax = self.minimax
-
-            if maxplayer:
-                for mv in board.legal_moves:
-                    board.push(mv)
-                    bestScore = compare(bestScore, minimax(board, ply - 1, alpha, beta))
-                    board.pop()
-                    alpha = compare(alpha, bestScore)
+            bound = EXACT
+        self.tt.store(key, ply + 1, bestScore, bound, bestMove)
+        return bestMove, bestScore
+
+    def nextResult(self, results, stopEvent):
+        # the next result of a pool.imap; a stop() meanwhile is passed on
+        # to the workers
+        while True:
+            try:
+                return results.next(0.05)
+            except multiprocessing.TimeoutError:
+                if self.stopped or (self.stopEvent is not None and self.stopEvent.is_set()):
+                    stopEvent.set()
+
+    def searchMove(self, position, move, ply, alpha, beta):
+        # score of one root move within the window
+        self.makeMove(position, move)
+        score = -self.negamax(position, ply, -beta, -alpha)
+        self.unmakeMove(position)
+        return score
+
+    def negamax(self, position, ply, alpha, beta):
+        # principal variation search; scores are from the point of view of the side to move
+        self.nodes += 1
+        if self.nodes >= self.checkNodes:
+            self.checkLimits()
+
+        if ply == 0:
+            # the horizon only needs to know whether there is a legal move at all
+            score = self.gameOverScore(position, position.hasLegalMove())
+            if score is None:
+                score = self.tablebaseScore(position)
+            if score is not None:
+                return score
+            if self.quiescence:
+                self.quiescenceBudget = self.nodes + AI.QUIESCENCE_NODES
+                return self.quiesce(position, alpha, beta)
+            return self.heuristic(position)
+
+        # the moves are pseudo-legal: checkmate and stalemate are found when
+        # none of them turns out legal, the draws by rule are tested here
+        score = self.gameOverScore(position, None)
+        if score is None:
+            score = self.tablebaseScore(position)
+        if score is not None:
+            return score
+
+        key = position.key
+        entry = self.tt.probe(key)
+        hashMove = None
+        if entry is not None:
+            hashMove = entry[MOVE]
+        if entry is not None and entry[DEPTH] >= ply:
+            score = entry[SCORE]
+            if entry[BOUND] == EXACT:
+                return score
+            elif entry[BOUND] == LOWERBOUND:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score
+
+        # the selective search leaves positions in check and the principal
+        # variation (nodes searched with an open window) alone
+        inCheck = position.inCheck()
+        selective = not inCheck and beta - alpha == 1
+        staticScore = None
+        if selective and (self.nullMove or self.futilityPruning):
+            staticScore = self.evaluator.evaluate(position.turn)
+
+        turn = position.turn
+        if self.nullMove and selective and ply >= AI.NULL_MOVE_MIN_PLY and staticScore >= beta and \
+                abs(beta) < AI.WIN_SCORE and position.undoMove[position.ply - 1] != NULL_MOVE and \
+                position.occ[turn] & ~(position.bb[PAWN | turn << 3] | position.bb[KING | turn << 3]):
+            # if passing is still good enough, a real move will be too; not two
+            # passes in a row, and not with pawns only, where zugzwang is common
+            self.makeMove(position, NULL_MOVE)
+            score = -self.negamax(position, max(ply - 1 - AI.NULL_MOVE_REDUCTION, 0), -beta, -beta + 1)
+            self.unmakeMove(position)
+            if score >= beta:
+                return beta if score >= AI.WIN_SCORE else score
+
+        # quiet moves that cannot lift the score up to alpha are not searched
+        futile = self.futilityPruning and selective and ply == 1 and staticScore + AI.FUTILITY_MARGIN <= alpha
+        reduce = self.lateMoveReductions and not inCheck and ply >= AI.LMR_MIN_PLY
+
+        alphaOrig = alpha
+        bestScore = -AI.INFINITE
+        bestMove = None
+        negamax = self.negamax
+        makeMove = self.makeMove
+        unmakeMove = self.unmakeMove
+        height = position.ply
+        killers = self.killers[height]
+        moves = self.orderMoves(position, position.generateMoves(), hashMove, height)
+        # legal moves made so far
+        index = 0
+        leafScores = None
+        if self.batchEvaluation and ply == 1:
+            leafScores = self.evaluator.evaluateMoves(position, moves)
+
+        for moveIndex, mv in enumerate(moves):
+            quiet = (futile or reduce) and not mv >> 12 and not position.isCapture(mv)
+            makeMove(position, mv)
+            if position.leftInCheck():
+                unmakeMove(position)
+                continue
+            index += 1
+            if futile and quiet and not position.inCheck():
+                unmakeMove(position)
+                if staticScore + AI.FUTILITY_MARGIN > bestScore:
+                    bestScore = staticScore + AI.FUTILITY_MARGIN
+                continue
+            if leafScores is not None:
+                self.leafScore = leafScores[moveIndex]
+            if bestMove is None:
+                score = -negamax(position, ply - 1, -beta, -alpha)
+            else:
+                # the first move is expected to be best: the others only have to
+                # be shown worse with a null window, and are searched again if not
+                depth = ply - 1
+                if reduce and quiet and index > AI.LMR_MIN_MOVES and mv not in killers and not position.inCheck():
+                    depth -= 1
+                score = -negamax(position, depth, -alpha - 1, -alpha)
+                if depth < ply - 1 and score > alpha:
+                    score = -negamax(position, ply - 1, -alpha - 1, -alpha)
+                if alpha < score < beta:
+                    if leafScores is not None:
+                        self.leafScore = leafScores[moveIndex]
+                    score = -negamax(position, ply - 1, -beta, -alpha)
+            self.leafScore = None
+            unmakeMove(position)
+            if score > bestScore:
+                bestScore = score
+                bestMove = mv
+                if score > alpha:
+                    alpha = score
                     if alpha >= beta:
+                        self.recordCutoff(position, mv, ply, height)
+                        if self.stats is not None:
+                            self.stats.cutoff(index - 1)
                         break
-            else:
-                for mv in board.legal_moves:
-                    board.push(mv)
-                    bestScore = compare(bestScore, minimax(board, ply - 1, alpha, beta))
-                    board.pop()
-                    beta = compare(beta, bestScore)
+
+        if index == 0:
+            # no legal move: checkmate or stalemate
+            return self.gameOverScore(position, False)
+
+        if bestScore <= alphaOrig:
+            bound = UPPERBOUND
+        elif bestScore >= beta:
+            bound = LOWERBOUND
+        else:
+            bound = EXACT
+        self.tt.store(key, ply, bestScore, bound, bestMove)
+
+        return bestScore
+
+    def quiesce(self, position, alpha, beta):
+        # captures-only search below the horizon, scores from the side to move's point of view
+        self.nodes += 1
+        if self.stats is not None:
+            self.stats.quiescenceNodes += 1
+        if self.nodes >= self.checkNodes:
+            self.checkLimits()
+
+        # stand pat: the side to move does not have to capture
+        standPat = self.heuristic(position)
+        if self.nodes >= self.quiescenceBudget or standPat >= beta:
+            return standPat
+        alpha = max(alpha, standPat)
+
+        squares = position.squares
+        captures = []
+        for mv in position.generateMoves(False):
+            victim = position.capturedType(mv)
+            gain = AI.PIECE_SCORES[victim]
+            if mv >> 12:
+                gain += AI.PIECE_SCORES[mv >> 12] - AI.PIECE_SCORES[PAWN]
+            # delta pruning: even winning the piece outright does not reach the window
+            if standPat + gain + AI.DELTA_MARGIN <= alpha:
+                continue
+            captures.append((8 * victim - (squares[mv & 63] & PIECE_MASK)) << AI.MOVE_BITS | mv)
+        captures.sort(reverse=True)
+
+        bestScore = standPat
+        quiesce = self.quiesce
+        evaluator = self.evaluator
+        mask = AI.MOVE_MASK
+        for item in captures:
+            mv = item & mask
+            evaluator.push(position, mv)
+            position.makeMove(mv)
+            if position.leftInCheck():
+                position.unmakeMove()
+                evaluator.pop()
+                continue
+            score = -quiesce(position, -beta, -alpha)
+            position.unmakeMove()
+            evaluator.pop()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
                     if alpha >= beta:
                         break
 
-            return bestScore
+        return bestScore
 
-    def heuristic(self, board):
-        if board.is_game_over():
-            if board.result() != '1/2-1/2':
-                iwin = (board.result() is '1-0') is self.player
-                return 2000 if iwin else -2000
-            else:
-                score = 0
-                for piece in chess.PIECE_TYPES:
-                    score += (len(board.pieces(piece, self.player)) - len(board.pieces(piece, not self.player))) * \
-                             AI.PIECE_SCORES[piece]
+    def heuristic(self, position):
+        # static score of a position that is not game over, from the side to move's point of view
+        if self.stats is not None:
+            self.stats.leafEvals += 1
+        score = self.leafScore
+        if score is not None:
+            # already scored in a batch with its siblings
+            self.leafScore = None
+            return score
+        return self.evaluator.evaluate(position.turn)
 
-                if score > 0:
-                    score = -score
-                return score
+    def gameOverScore(self, position, hasMoves):
+        # score of a finished game from the side to move's point of view, or
+        # None while it goes on.  Follows board.is_game_over() and
+        # board.result(): no legal moves is checkmate in check and stalemate
+        # otherwise, and both come before the 75-move rule, insufficient
+        # material and fivefold repetition.  hasMoves None means not known
+        # yet, it is then only looked up when one of the draws applies
+        if hasMoves or hasMoves is None:
+            if position.halfmove < 150 and not position.insufficientMaterial() and \
+                    (position.halfmove < FIVEFOLD_PLIES or position.repetitions() < 5):
+                return None
+            if hasMoves is None:
+                return self.gameOverScore(position, position.hasLegalMove())
+            score = self.drawScore(position.turn)
+        elif position.inCheck():
+            score = -AI.WIN_SCORE
         else:
-            score = 0
-            for piece in chess.PIECE_TYPES:
-                score += (len(board.pieces(piece, self.player)) - len(board.pieces(piece, not self.player))) * \
-                         AI.PIECE_SCORES[piece]
-            return score
+            score = self.drawScore(position.turn)
+        if self.stats is not None:
+            self.stats.terminals += 1
+        return score
+
+    def tablebaseScore(self, position):
+        # score of a position in the tablebases from the side to move's point
+        # of view, or None.  Only probed right after a capture or pawn move:
+        # that is how the material comes down into the tables, and there the
+        # 50-move counter the WDL values assume is zero
+        if self.tablebase is None or position.halfmove or position.castling or \
+                chess.popcount(position.occ[0] | position.occ[1]) > self.tablebasePieces:
+            return None
+        wdl = self.tablebase.probeWdl(position)
+        if wdl is None:
+            return None
+        if self.stats is not None:
+            self.stats.tablebaseHits += 1
+        if wdl == 2:
+            return AI.TABLEBASE_WIN
+        elif wdl == -2:
+            return -AI.TABLEBASE_WIN
+        # wins and losses the 50-move rule turns into draws
+        return self.drawScore(position.turn)
+
+    def drawScore(self, color):
+        # a draw is only welcome to self.player when behind in material
+        score = self.evaluator.materialBalance(self.player)
+        if score > 0:
+            score = -score
+        return score if color == self.player else -score
 
 def main():
     board = chess.Board()
@@ -135,6 +913,8 @@ def main():
         board.push(mv)
 
     print board
+    print 'TT white', ai.tt.stats()
+    print 'TT black', ai1.tt.stats()
 
 if __name__ == '__main__':
     main()
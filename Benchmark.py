@@ -0,0 +1,255 @@
+#! /usr/bin/env python
+"""
+ Project: Python Chess
+ File name: Benchmark.py
+ Description:  Search benchmark.  Searches a fixed set of positions to a
+	fixed depth with each engine configuration and prints the node count,
+	nodes per second, time to depth and best move of every position.
+	The node counts do not depend on the machine, so their totals act as
+	a signature of the search: comparing them with the stored baseline
+	catches changes that were not meant to alter the search.
+
+	Examples:
+	  python Benchmark.py                  compare every config with the baseline
+	  python Benchmark.py -c default       only the default config
+	  python Benchmark.py --save           store the current results as the baseline
+	  python Benchmark.py --stats s.jsonl  also write the search statistics
+	  python Benchmark.py --perft 3        check the search's move generator
+	  python Benchmark.py --check-eval 2   check batch against scalar evaluation
+ """
+
+import json
+import os
+import sys
+import timeit
+from optparse import OptionParser
+
+import chess
+
+from AI import AI
+from Evaluation import MaterialEvaluator, BatchEvaluator
+from Position import fromBoard
+
+BASELINE_PATH = os.path.join('data', 'bench.json')
+
+POSITIONS = [
+    # open game after 1.e4 e5 2.Nf3 Nc6
+    'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3',
+    # "Kiwipete", many captures, castling and pins
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    # rook endgame
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    # Sicilian Dragon middlegame
+    'r1bq1rk1/pp2ppbp/2np1np1/8/3NP3/2N1BP2/PPPQ2PP/R3KB1R w KQ - 3 9',
+    # queen's gambit declined
+    'rnbqkb1r/ppp2ppp/4pn2/3p4/2PP4/2N5/PP2PPPP/R1BQKBNR w KQkq - 2 4',
+    # white king stranded in the centre, black to move
+    'r1b1kb1r/pppp1ppp/5q2/4n3/3KP3/2N3PN/PPP4P/R1BQ1B1R b kq - 0 1',
+]
+
+# named engine configurations, as AI keyword arguments
+CONFIGS = {
+    'default': {},
+    'pst': {'pieceSquareTables': True},
+    'noquiescence': {'quiescence': False},
+    'nonullmove': {'nullMove': False},
+    'nolmr': {'lateMoveReductions': False},
+    'nofutility': {'futilityPruning': False},
+    'noselective': {'nullMove': False, 'lateMoveReductions': False, 'futilityPruning': False},
+}
+
+
+def benchPosition(fen, depth, config, stats=False):
+    board = chess.Board(fen)
+    ai = AI(board, board.turn, depth, stats=stats, **config)
+    start = timeit.default_timer()
+    move = ai.getMinimaxMove()
+    elapsed = timeit.default_timer() - start
+    result = {'fen': fen, 'move': move.uci(), 'nodes': ai.nodes, 'time': elapsed}
+    if ai.stats is not None:
+        result['stats'] = ai.stats.toDict()
+    return result
+
+
+def benchConfig(name, depth, statsFile=None):
+    config = CONFIGS[name]
+    results = []
+    print '%s %s' % (name, config)
+    for fen in POSITIONS:
+        result = benchPosition(fen, depth, config, statsFile is not None)
+        if statsFile is not None:
+            record = result.pop('stats')
+            record['config'] = name
+            statsFile.write(json.dumps(record, sort_keys=True) + '\n')
+        results.append(result)
+        print '  %-6s %10d nodes %8.0f nps %7.2f s  %s' % (
+            result['move'], result['nodes'], result['nodes'] / max(result['time'], 1e-9), result['time'], fen)
+    nodes = sum(result['nodes'] for result in results)
+    elapsed = sum(result['time'] for result in results)
+    print '  total  %10d nodes %8.0f nps %7.2f s' % (nodes, nodes / max(elapsed, 1e-9), elapsed)
+    return {'nodes': nodes, 'positions': results}
+
+
+def perftBoard(board, depth):
+    # python-chess's count of the legal move sequences, the reference for perft
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += perftBoard(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def perftPositions(depth):
+    # perft of every position with the search's Position; returns the number of mismatches
+    mismatches = 0
+    print 'perft %d' % depth
+    for fen in POSITIONS:
+        board = chess.Board(fen)
+        position = fromBoard(board)
+        start = timeit.default_timer()
+        nodes = position.perft(depth)
+        elapsed = timeit.default_timer() - start
+        expected = perftBoard(board, depth)
+        note = ''
+        if nodes != expected:
+            mismatches += 1
+            note = '  python-chess counts %d' % expected
+        print '  %10d nodes %8.0f nps %7.2f s  %s%s' % (nodes, nodes / max(elapsed, 1e-9), elapsed, fen, note)
+    return mismatches
+
+
+def checkEvaluation(depth):
+    # scores the children of every node of the bench positions' trees with
+    # the scalar and the batch evaluator; returns the number of disagreements
+    mismatches = 0
+    for pieceSquareTables in (False, True):
+        scalar = MaterialEvaluator(pieceSquareTables)
+        batch = BatchEvaluator(pieceSquareTables)
+        times = {scalar: 0.0, batch: 0.0}
+        nodes = [0]
+
+        def walk(position, depth):
+            moves = position.legalMoves()
+            scores = []
+            for evaluator in (scalar, batch):
+                start = timeit.default_timer()
+                scores.append(evaluator.evaluateMoves(position, moves))
+                times[evaluator] += timeit.default_timer() - start
+            nodes[0] += 1
+            failures = 0 if scores[0] == scores[1] else 1
+            if depth > 1:
+                for move in moves:
+                    scalar.push(position, move)
+                    batch.push(position, move)
+                    position.makeMove(move)
+                    failures += walk(position, depth - 1)
+                    position.unmakeMove()
+                    batch.pop()
+                    scalar.pop()
+            return failures
+
+        for fen in POSITIONS:
+            position = fromBoard(chess.Board(fen))
+            scalar.reset(position)
+            batch.reset(position)
+            failures = walk(position, depth)
+            if failures:
+                print '  %d nodes disagree in %s' % (failures, fen)
+            mismatches += failures
+        print 'pieceSquareTables=%s: %d nodes, scalar %.1f us, batch %.1f us per node' % (
+            pieceSquareTables, nodes[0], times[scalar] / nodes[0] * 1e6, times[batch] / nodes[0] * 1e6)
+    return mismatches
+
+
+def compare(name, current, baseline):
+    # returns a list of differences between a config's run and its baseline
+    if baseline is None:
+        return ['%s: no baseline' % name]
+    problems = []
+    for now, then in zip(current['positions'], baseline['positions']):
+        if now['fen'] != then['fen']:
+            problems.append('%s: position list changed' % name)
+            break
+        if now['nodes'] != then['nodes'] or now['move'] != then['move']:
+            problems.append('%s: %s  %s %d nodes, baseline %s %d nodes' % (
+                name, now['fen'], now['move'], now['nodes'], then['move'], then['nodes']))
+    return problems
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-d", dest="depth", type="int", default=4, help="Search depth")
+    parser.add_option("-c", dest="configs", action="append", default=None,
+                      help="Config to run (may be repeated), one of: " + ", ".join(sorted(CONFIGS)))
+    parser.add_option("-b", dest="baseline", default=BASELINE_PATH, help="Baseline JSON file")
+    parser.add_option("--save", dest="save", action="store_true", default=False,
+                      help="Write the results as the new baseline")
+    parser.add_option("--stats", dest="stats", default=None,
+                      help="Write the search statistics of every position to this JSON lines file")
+    parser.add_option("--perft", dest="perft", type="int", default=None,
+                      help="Only compare the move generator with python-chess, to this depth")
+    parser.add_option("--check-eval", dest="check_eval", type="int", default=None,
+                      help="Only compare batch with scalar evaluation (needs numpy), to this depth")
+    (options, args) = parser.parse_args()
+
+    if options.check_eval is not None:
+        if checkEvaluation(options.check_eval):
+            print 'batch evaluation differs from scalar evaluation'
+            sys.exit(1)
+        print 'batch evaluation matches scalar evaluation'
+        return
+    if options.perft is not None:
+        if perftPositions(options.perft):
+            print 'perft differs from python-chess'
+            sys.exit(1)
+        print 'perft matches python-chess'
+        return
+
+    names = options.configs or sorted(CONFIGS)
+    statsFile = open(options.stats, 'w') if options.stats else None
+    results = {}
+    try:
+        for name in names:
+            results[name] = benchConfig(name, options.depth, statsFile)
+    finally:
+        if statsFile is not None:
+            statsFile.close()
+
+    stored = {'depth': options.depth, 'configs': {}}
+    if os.path.isfile(options.baseline):
+        with open(options.baseline) as f:
+            stored = json.load(f)
+
+    if options.save:
+        if stored['depth'] != options.depth:
+            stored = {'depth': options.depth, 'configs': {}}
+        for name in names:
+            stored['configs'][name] = {
+                'nodes': results[name]['nodes'],
+                'positions': [{'fen': r['fen'], 'move': r['move'], 'nodes': r['nodes']}
+                              for r in results[name]['positions']]}
+        with open(options.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print 'baseline written to %s' % options.baseline
+        return
+
+    if stored['depth'] != options.depth:
+        print 'baseline is for depth %d, not compared' % stored['depth']
+        return
+    problems = []
+    for name in names:
+        problems.extend(compare(name, results[name], stored['configs'].get(name)))
+    if problems:
+        print 'signature differs from the baseline:'
+        for problem in problems:
+            print '  ' + problem
+        sys.exit(1)
+    print 'signature matches the baseline'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+"""
+ Project: Python Chess
+ File name: BookBuilder.py
+ Description:  Builds a polyglot opening book from our own games: PGN
+	archives and SelfPlay.py logs (files ending in .jsonl).  The files are
+	streamed and counted in chunks by a pool of worker processes like
+	GameIndex.py does, the first --max-ply moves of every game per
+	position key and move, by result.  Counts are held in memory up to
+	--memory entries and then spilled to a sorted run file, and the runs
+	are merged at the end, so the book size is not bounded by RAM.
+
+	A move's weight is --win points per game the side to move won,
+	--draw per draw and --loss per loss; moves played in fewer than
+	--min-games games or without weight are left out.  The result is a
+	sorted .bin file for OpeningBook, e.g. AI(bookPath='data/book.bin').
+
+	Examples:
+	  python BookBuilder.py -o data/book.bin -j 8 archive.pgn selfplay.jsonl
+	  python BookBuilder.py --min-games 5 --win 3 --draw 1 archive.pgn
+ """
+
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import timeit
+from itertools import groupby
+from optparse import OptionParser
+
+import chess
+from chess import polyglot
+
+from GameIndex import GameVisitor, readGames, splitFile, _initWorker, RESULTS, CHUNK_SIZE
+from Position import fromBoard, packMove, WHITE, KING, MAX_DEPTH
+
+BOOK_PATH = os.path.join('data', 'book.bin')
+# plies of every game that go into the book
+MAX_PLY = 40
+MIN_GAMES = 2
+# counts held in memory before they are spilled to a run file
+MEMORY_ENTRIES = 1 << 20
+# weights of a win, draw and loss of the side to move
+WIN_WEIGHT = 2
+DRAW_WEIGHT = 1
+LOSS_WEIGHT = 0
+# largest weight of a polyglot entry
+MAX_WEIGHT = 0xFFFF
+
+# run file record: key, move, and the wins, draws and losses of the side to move
+RUN_STRUCT = struct.Struct('>QHIII')
+RUN_BLOCK = 4096
+
+
+def polyglotMove(position, move):
+    # a packed move as polyglot books store it: the squares the other way
+    # round, promotions counted from the knight, and castling moving the
+    # king onto its rook
+    fromSquare = move & 63
+    toSquare = move >> 6 & 63
+    promotion = move >> 12
+    if position.pieceTypeAt(fromSquare) == KING and abs(toSquare - fromSquare) == 2:
+        toSquare = fromSquare + 3 if toSquare > fromSquare else fromSquare - 4
+    return toSquare | fromSquare << 6 | (promotion - 1 if promotion else 0) << 12
+
+
+class BookVisitor(GameVisitor):
+    def entry(self, move):
+        position = self.position
+        return position.key, polyglotMove(position, move), position.turn
+
+
+def selfPlayGames(handle, end=None, maxPly=MAX_PLY):
+    # yields (result, [(key, move, turn)]) for the SelfPlay records of an
+    # open log, from its current offset up to end
+    while end is None or handle.tell() < end:
+        line = handle.readline()
+        if not line:
+            return
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        position = fromBoard(chess.Board())
+        moves = []
+        for uci in record['moves'][:min(maxPly, MAX_DEPTH)]:
+            move = packMove(chess.Move.from_uci(uci))
+            moves.append((position.key, polyglotMove(position, move), position.turn))
+            position.makeMove(move)
+        yield record['result'], moves
+
+
+def countChunk(task):
+    # runs in a pool worker; counts the wins, draws and losses of the side
+    # to move for every position and move of the games of one chunk
+    path, start, end, maxPly = task
+    counts = {}
+    games = skipped = 0
+    with open(path) as handle:
+        handle.seek(start)
+        if path.endswith('.jsonl'):
+            source = selfPlayGames(handle, end, maxPly)
+        else:
+            source = ((None if game.broken else game.gameResult or game.headerResult, game.moves)
+                      for game in readGames(handle, end, maxPly, BookVisitor))
+        for result, moves in source:
+            result = RESULTS.get(result)
+            if result is None:
+                skipped += 1
+                continue
+            games += 1
+            for key, move, turn in moves:
+                count = counts.get((key, move))
+                if count is None:
+                    count = counts[key, move] = [0, 0, 0]
+                count[result if turn == WHITE else 2 - result] += 1
+    return counts, games, skipped
+
+
+def writeRun(counts, directory):
+    # spills counts to a new run file sorted by key and move; returns its path
+    handle, path = tempfile.mkstemp('.run', dir=directory)
+    with os.fdopen(handle, 'wb') as run:
+        for key, move in sorted(counts):
+            run.write(RUN_STRUCT.pack(key, move, *counts[key, move]))
+    return path
+
+
+def readRun(path):
+    # yields the records of a run file, a block at a time
+    size = RUN_STRUCT.size
+    with open(path, 'rb') as run:
+        while True:
+            block = run.read(size * RUN_BLOCK)
+            if not block:
+                return
+            for offset in xrange(0, len(block), size):
+                yield RUN_STRUCT.unpack_from(block, offset)
+
+
+def mergeRuns(paths):
+    # yields (key, move, wins, draws, losses) in key and move order, the
+    # counts of every run added up
+    records = heapq.merge(*[readRun(path) for path in paths])
+    for (key, move), group in groupby(records, lambda record: record[:2]):
+        wins = draws = losses = 0
+        for record in group:
+            wins += record[2]
+            draws += record[3]
+            losses += record[4]
+        yield key, move, wins, draws, losses
+
+
+def writeBook(records, path, minGames=MIN_GAMES, weights=(WIN_WEIGHT, DRAW_WEIGHT, LOSS_WEIGHT)):
+    # writes merged records as polyglot entries, the moves of every key by
+    # descending weight; returns the number of positions and entries
+    win, draw, loss = weights
+    positions = entries = 0
+    with open(path, 'wb') as book:
+        for key, group in groupby(records, lambda record: record[0]):
+            moves = []
+            for key, move, wins, draws, losses in group:
+                weight = win * wins + draw * draws + loss * losses
+                if wins + draws + losses >= minGames and weight > 0:
+                    moves.append((weight, move))
+            if not moves:
+                continue
+            # weights of a position that do not fit are scaled down together
+            heaviest = max(moves)[0]
+            if heaviest > MAX_WEIGHT:
+                moves = [(max(weight * MAX_WEIGHT // heaviest, 1), move) for weight, move in moves]
+            moves.sort(key=lambda entry: (-entry[0], entry[1]))
+            for weight, move in moves:
+                book.write(polyglot.ENTRY_STRUCT.pack(key, move, weight, 0))
+            positions += 1
+            entries += len(moves)
+    return positions, entries
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] FILE.pgn|FILE.jsonl ...")
+    parser.add_option("-o", dest="book", default=BOOK_PATH, help="Polyglot book to write")
+    parser.add_option("-j", dest="workers", type="int", default=multiprocessing.cpu_count(),
+                      help="Number of chunks counted at the same time")
+    parser.add_option("--max-ply", dest="max_ply", type="int", default=MAX_PLY,
+                      help="Plies of every game that go into the book")
+    parser.add_option("--min-games", dest="min_games", type="int", default=MIN_GAMES,
+                      help="Games a move needs to be in the book")
+    parser.add_option("--win", dest="win", type="int", default=WIN_WEIGHT, help="Weight of a win")
+    parser.add_option("--draw", dest="draw", type="int", default=DRAW_WEIGHT, help="Weight of a draw")
+    parser.add_option("--loss", dest="loss", type="int", default=LOSS_WEIGHT, help="Weight of a loss")
+    parser.add_option("--memory", dest="memory", type="int", default=MEMORY_ENTRIES,
+                      help="Counts held in memory before they are spilled to disk")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int", default=CHUNK_SIZE >> 20,
+                      help="Megabytes of games counted by a worker at a time")
+    parser.add_option("--tmp", dest="tmp", default=None, help="Directory for the run files")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('no game files given')
+
+    tasks = []
+    for path in args:
+        marker = '' if path.endswith('.jsonl') else '[Event '
+        for start, end in splitFile(path, max(options.chunk_size, 1) << 20, marker):
+            tasks.append((path, start, end, options.max_ply))
+
+    start = timeit.default_timer()
+    directory = tempfile.mkdtemp(prefix='book', dir=options.tmp)
+    pool = multiprocessing.Pool(options.workers, _initWorker)
+    try:
+        counts = {}
+        runs = []
+        totalGames = totalSkipped = 0
+        for chunkCounts, games, skipped in pool.imap_unordered(countChunk, tasks):
+            totalGames += games
+            totalSkipped += skipped
+            for entry, count in chunkCounts.iteritems():
+                total = counts.get(entry)
+                if total is None:
+                    counts[entry] = count
+                else:
+                    total[0] += count[0]
+                    total[1] += count[1]
+                    total[2] += count[2]
+            if len(counts) >= options.memory:
+                runs.append(writeRun(counts, directory))
+                counts = {}
+        if counts:
+            runs.append(writeRun(counts, directory))
+        counts = None
+        print '%d games counted, %d skipped, %d run files' % (totalGames, totalSkipped, len(runs))
+        positions, entries = writeBook(mergeRuns(runs), options.book, options.min_games,
+                                       (options.win, options.draw, options.loss))
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(directory)
+    print '%s: %d positions, %d moves, in %.1fs' % (options.book, positions, entries,
+                                                   timeit.default_timer() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,10 @@ class ChessGUI_pygame:
         self.LoadImages(graphicStyle)
         # pygame.font.init() - should be already called by pygame.init()
         self.fontDefault = pygame.font.Font(None, 20)
+        self.background = None
+        # (piece symbol, highlighted) of every square as it is on the screen
+        self.drawnSquares = {}
+        self.fullRedraw = True
 
     def LoadImages(self, graphicStyle):
         if graphicStyle == 0:
@@ -88,10 +92,22 @@ class ChessGUI_pygame:
             self.white_queen = pygame.image.load(os.path.join("images", "Chess_tile_ql.png")).convert()
             self.white_queen = pygame.transform.scale(self.white_queen, (self.square_size, self.square_size))
 
+        self.pieceImages = {(chess.BLACK, chess.PAWN): self.black_pawn,
+                            (chess.BLACK, chess.ROOK): self.black_rook,
+                            (chess.BLACK, chess.KNIGHT): self.black_knight,
+                            (chess.BLACK, chess.BISHOP): self.black_bishop,
+                            (chess.BLACK, chess.QUEEN): self.black_queen,
+                            (chess.BLACK, chess.KING): self.black_king,
+                            (chess.WHITE, chess.PAWN): self.white_pawn,
+                            (chess.WHITE, chess.ROOK): self.white_rook,
+                            (chess.WHITE, chess.KNIGHT): self.white_knight,
+                            (chess.WHITE, chess.BISHOP): self.white_bishop,
+                            (chess.WHITE, chess.QUEEN): self.white_queen,
+                            (chess.WHITE, chess.KING): self.white_king}
+
     def PrintMessage(self, message):
-        # prints a string to the area to the right of the board
+        # prints a string to the area to the right of the board (shown by the next Draw)
         self.textBox.Add(message)
-        self.textBox.Draw()
 
     def ConvertToScreenCoords(self, chessSquare):
         # converts a (row,col) chessSquare into the pixel location of the upper-left corner of the square
@@ -112,24 +128,16 @@ class ChessGUI_pygame:
         col = (X - self.boardStart_x) / self.square_size
         return col, 7 - row
 
-    def Draw(self, board, highlightSquares=[]):
-        self.screen.fill((0, 0, 0))
-        self.textBox.Draw()
+    def BuildBackground(self):
+        # the empty board and the row/column labels never change, so they are
+        # drawn once onto a surface that later frames copy from
+        background = pygame.Surface(self.screen.get_size()).convert()
+        background.fill((0, 0, 0))
         boardSize = 8  # board should be square.  boardSize should be always 8 for chess, but I dislike "magic numbers"
 
         # draw blank board
-        brown = False
         for square in chess.SQUARES:
-            (screenX, screenY) = self.ConvertToScreenCoords(square)
-            if brown:
-                self.screen.blit(self.brown_square, (screenX, screenY))
-
-            else:
-                self.screen.blit(self.white_square, (screenX, screenY))
-
-            brown = not brown
-            if (square + 1) % 8 == 0:
-                brown = not brown
+            background.blit(self.SquareImage(square), self.ConvertToScreenCoords(square))
 
         # draw row/column labels around the edge of the board
         color = (255, 255, 255)  # white
@@ -139,61 +147,83 @@ class ChessGUI_pygame:
         # top and bottom - display cols
         for c in range(boardSize):
             # render letters
+            renderedLine = self.fontDefault.render(chars[c], antialias, color)
             screenX = (c + 1) * self.square_size + self.square_size / 2
             screenY = self.square_size / 2
-            renderedLine = self.fontDefault.render(chars[c], antialias, color)
-            self.screen.blit(renderedLine, (screenX, screenY))
+            background.blit(renderedLine, (screenX, screenY))
             screenY = (boardSize + 1) * self.square_size + self.square_size / 2
-            renderedLine = self.fontDefault.render(chars[c], antialias, color)
-            self.screen.blit(renderedLine, (screenX, screenY))
+            background.blit(renderedLine, (screenX, screenY))
 
             # render numbers
+            renderedLine = self.fontDefault.render(str(8 - c), antialias, color)
             screenY = (c + 1) * self.square_size + self.square_size / 2
             screenX = self.square_size / 2
-            renderedLine = self.fontDefault.render(str(8 - c), antialias, color)
-            self.screen.blit(renderedLine, (screenX, screenY))
+            background.blit(renderedLine, (screenX, screenY))
             screenX = (boardSize + 1) * self.square_size + self.square_size / 2
-            renderedLine = self.fontDefault.render(str(8 - c), antialias, color)
-            self.screen.blit(renderedLine, (screenX, screenY))
+            background.blit(renderedLine, (screenX, screenY))
 
-        # highlight squares if specified
-        for square in highlightSquares:
-            (screenX, screenY) = self.ConvertToScreenCoords(square)
-            self.screen.blit(self.cyan_square, (screenX, screenY))
+        self.background = background
 
-        # draw pieces
+    def SquareImage(self, square):
+        if (chess.square_file(square) + chess.square_rank(square)) % 2:
+            return self.brown_square
+        return self.white_square
+
+    def Invalidate(self):
+        # forget what is on screen, the next Draw repaints everything
+        self.drawnSquares = {}
+        self.fullRedraw = True
+
+    def Draw(self, board, highlightSquares=[]):
+        # only squares whose piece or highlight changed since the last Draw are
+        # repainted, and only their rectangles are pushed to the display
+        if self.background is None:
+            self.BuildBackground()
+        dirtyRects = []
+        if self.fullRedraw:
+            self.screen.blit(self.background, (0, 0))
+            dirtyRects.append(self.screen.get_rect())
+            self.fullRedraw = False
+            # the background covered the message log too
+            self.textBox.dirty = True
+
+        highlighted = set(highlightSquares)
         for square in chess.SQUARES:
-            (screenX, screenY) = self.ConvertToScreenCoords(square)
             piece = board.piece_at(square)
-            if piece:
-                if piece.color is chess.BLACK:
-                    if piece.piece_type == chess.PAWN:
-                        self.screen.blit(self.black_pawn, (screenX, screenY))
-                    if piece.piece_type == chess.ROOK:
-                        self.screen.blit(self.black_rook, (screenX, screenY))
-                    if piece.piece_type == chess.KNIGHT:
-                        self.screen.blit(self.black_knight, (screenX, screenY))
-                    if piece.piece_type == chess.BISHOP:
-                        self.screen.blit(self.black_bishop, (screenX, screenY))
-                    if piece.piece_type == chess.QUEEN:
-                        self.screen.blit(self.black_queen, (screenX, screenY))
-                    if piece.piece_type == chess.KING:
-                        self.screen.blit(self.black_king, (screenX, screenY))
-                if piece.color == chess.WHITE:
-                    if piece.piece_type == chess.PAWN:
-                        self.screen.blit(self.white_pawn, (screenX, screenY))
-                    if piece.piece_type == chess.ROOK:
-                        self.screen.blit(self.white_rook, (screenX, screenY))
-                    if piece.piece_type == chess.KNIGHT:
-                        self.screen.blit(self.white_knight, (screenX, screenY))
-                    if piece.piece_type == chess.BISHOP:
-                        self.screen.blit(self.white_bishop, (screenX, screenY))
-                    if piece.piece_type == chess.QUEEN:
-                        self.screen.blit(self.white_queen, (screenX, screenY))
-                    if piece.piece_type == chess.KING:
-                        self.screen.blit(self.white_king, (screenX, screenY))
-
-        pygame.display.flip()
+            state = (piece.symbol() if piece else None, square in highlighted)
+            if self.drawnSquares.get(square) == state:
+                continue
+            self.drawnSquares[square] = state
+            dirtyRects.append(self.DrawSquare(square, piece, state[1]))
+
+        if self.textBox.dirty:
+            self.textBox.Draw()
+            dirtyRects.append(self.textBox.GetRect())
+
+        if dirtyRects:
+            pygame.display.update(dirtyRects)
+
+    def DrawSquare(self, square, piece, highlighted):
+        (screenX, screenY) = self.ConvertToScreenCoords(square)
+        if highlighted:
+            self.screen.blit(self.cyan_square, (screenX, screenY))
+        else:
+            self.screen.blit(self.SquareImage(square), (screenX, screenY))
+        if piece:
+            self.screen.blit(self.pieceImages[(piece.color, piece.piece_type)], (screenX, screenY))
+        return pygame.Rect(screenX, screenY, self.square_size, self.square_size)
+
+    def ScrollMessages(self, e):
+        # mouse wheel and page up/down scroll the message history;
+        # returns True if the event was used for that
+        if e.type is MOUSEBUTTONDOWN and e.button in (4, 5):
+            self.textBox.Scroll(3 if e.button == 4 else -3)
+            return True
+        if e.type is KEYDOWN and e.key in (K_PAGEUP, K_PAGEDOWN):
+            page = self.textBox.maxLines - 1
+            self.textBox.Scroll(page if e.key == K_PAGEUP else -page)
+            return True
+        return False
 
     def EndGame(self, board):
         self.PrintMessage("Press any key to exit.")
@@ -201,77 +231,93 @@ class ChessGUI_pygame:
         pygame.event.set_blocked(MOUSEMOTION)
         while 1:
             e = pygame.event.wait()
+            if self.ScrollMessages(e):
+                self.Draw(board)
+                continue
             if e.type is KEYDOWN:
                 pygame.quit()
                 sys.exit(0)
             if e.type is QUIT:
                 pygame.quit()
                 sys.exit(0)
+            if e.type is VIDEOEXPOSE:
+                self.Invalidate()
+                self.Draw(board)
+
+    def LegalMoveIndex(self, board):
+        # {from_square: {to_square: [moves]}} for the side to move, built once per
+        # position; a destination holds several moves only for pawn promotions
+        index = {}
+        for move in board.generate_legal_moves():
+            index.setdefault(move.from_square, {}).setdefault(move.to_square, []).append(move)
+        return index
+
+    def GetPromotionChoice(self, board, moves):
+        # asks which piece the pawn promotes to; returns the chosen move, or None
+        # when the player presses escape to pick another move
+        keys = {K_q: chess.QUEEN, K_r: chess.ROOK, K_b: chess.BISHOP, K_n: chess.KNIGHT}
+        self.PrintMessage("Promote to (q)ueen, (r)ook, (b)ishop or k(n)ight?")
+        self.Draw(board, [moves[0].to_square])
+        while 1:
+            e = pygame.event.wait()
+            if e.type is QUIT:
+                pygame.quit()
+                sys.exit(0)
+            if e.type is VIDEOEXPOSE:
+                self.Invalidate()
+            if self.ScrollMessages(e):
+                pass
+            elif e.type is KEYDOWN:
+                if e.key == K_ESCAPE:
+                    return None
+                for move in moves:
+                    if move.promotion == keys.get(e.key):
+                        return move
+            self.Draw(board, [moves[0].to_square])
 
     def GetPlayerInput(self, board):
-        # returns ((from_row,from_col),(to_row,to_col))
-        fromSquareChosen = 0
-        toSquareChosen = 0
-        while not fromSquareChosen or not toSquareChosen:
+        # returns the chosen legal chess.Move, promotion included
+        movesFrom = self.LegalMoveIndex(board)
+        fromSquare = None
+        while 1:
             squareClicked = -1
             pygame.event.set_blocked(MOUSEMOTION)
             e = pygame.event.wait()
-            if e.type is KEYDOWN:
+            if self.ScrollMessages(e):
+                pass  # squareClicked stays -1, the board is just redrawn
+            elif e.type is KEYDOWN:
                 if e.key is K_ESCAPE:
-                    fromSquareChosen = 0
-                    fromTuple = []
-            if e.type is MOUSEBUTTONDOWN:
+                    fromSquare = None
+            elif e.type is MOUSEBUTTONDOWN:
                 (mouseX, mouseY) = pygame.mouse.get_pos()
                 coords = self.ConvertToChessCoords((mouseX, mouseY))
                 if coords[0] < 0 or coords[0] > 7 or coords[1] < 0 or coords[1] > 7:
-                    squareClicked = []  # not a valid chess square
+                    squareClicked = None  # not a valid chess square
                 else:
                     squareClicked = chess.square(coords[0], coords[1])
             if e.type is QUIT:  # the "x" kill button
                 pygame.quit()
                 sys.exit(0)
+            if e.type is VIDEOEXPOSE:  # window uncovered, the screen contents are lost
+                self.Invalidate()
+
+            if squareClicked != -1:
+                if fromSquare is not None and squareClicked in movesFrom[fromSquare]:
+                    moves = movesFrom[fromSquare][squareClicked]
+                    move = moves[0] if len(moves) == 1 else self.GetPromotionChoice(board, moves)
+                    if move is not None:
+                        return move
+                elif squareClicked in movesFrom and squareClicked != fromSquare:
+                    fromSquare = squareClicked
+                else:
+                    # clicking the chosen piece again, an empty square, an enemy
+                    # piece that cannot be taken or a piece with no moves deselects
+                    fromSquare = None
 
-            if not fromSquareChosen and not toSquareChosen:
+            if fromSquare is None:
                 self.Draw(board)
-                if squareClicked != -1:
-                    allowedSquares = []
-                    if board.piece_at(squareClicked) and board.turn == board.piece_at(squareClicked).color:
-                        for move in board.legal_moves:
-                            if move.from_square == squareClicked:
-                                allowedSquares.append(move.to_square)
-                        if len(allowedSquares) > 0:
-                            fromSquareChosen = 1
-                            fromSquare = squareClicked
-
-            elif fromSquareChosen and not toSquareChosen:
-                possibleDestinations = allowedSquares
-                self.Draw(board, possibleDestinations)
-                if squareClicked != -1:
-
-                    if squareClicked in possibleDestinations:
-                        toSquareChosen = 1
-                        toSquare = squareClicked
-
-                    elif board.piece_at(squareClicked) and board.turn == board.piece_at(squareClicked).color:
-                        allowedDestinationSquares = []
-                        for move in board.legal_moves:
-                            if move.from_square == squareClicked:
-                                allowedDestinationSquares.append(move.to_square)
-
-                        if squareClicked == fromSquare:
-                            fromSquareChosen = 0
-                        elif len(allowedDestinationSquares) > 0:
-                            fromSquareChosen = 1
-                            fromSquare = squareClicked
-                            possibleDestinations = allowedDestinationSquares
-                            allowedSquares = allowedDestinationSquares
-                            self.Draw(board, possibleDestinations)
-                        else:
-                            fromSquareChosen = 0  # piece is of own color, but no possible moves
-                    else:  # blank square or opposite color piece not in possible destinations clicked
-                        fromSquareChosen = 0
-
-        return chess.Move(fromSquare, toSquare)
+            else:
+                self.Draw(board, list(movesFrom[fromSquare]))
 
     def GetClickedSquare(self, mouseX, mouseY):
         # test function
@@ -28,6 +28,7 @@ class TkinterGameSetupParams:
 
         Label(self.frame, text="Type").grid(row=1, column=2)
         Label(self.frame, text="Search Depth").grid(row=1, column=4)
+        Label(self.frame, text="Move Time (s)").grid(row=1, column=5)
 
         Label(self.frame, text="Player 1 (White)").grid(row=2, column=0)
 
@@ -40,6 +41,10 @@ class TkinterGameSetupParams:
         self.entry_player1Depth.grid(row=2, column=4)
         self.entry_player1Depth.insert(ANCHOR, 4)
 
+        self.entry_player1Time = Entry(self.frame)
+        self.entry_player1Time.grid(row=2, column=5)
+        self.entry_player1Time.insert(ANCHOR, 0)
+
         Label(self.frame, text="Player 2 (Black)").grid(row=3, column=0)
 
         self.tk_player2Type = StringVar()
@@ -51,7 +56,12 @@ class TkinterGameSetupParams:
         self.entry_player2Depth.grid(row=3, column=4)
         self.entry_player2Depth.insert(ANCHOR, 4)
 
+        self.entry_player2Time = Entry(self.frame)
+        self.entry_player2Time.grid(row=3, column=5)
+        self.entry_player2Time.insert(ANCHOR, 0)
+
         Label(self.frame, text="AI with search depth less \nthan 1 behaves randomly").grid(row=4, column=4)
+        Label(self.frame, text="AI with move time above 0 \nsearches as deep as time allows").grid(row=4, column=5)
 
         b = Button(self.frame, text="Start the Game!", command=self.ok)
         b.grid(row=5, column=1)
@@ -61,15 +71,18 @@ class TkinterGameSetupParams:
         # hardcoded so that player 1 is always white
         self.player1Type = self.tk_player1Type.get()
         self.player1Depth = int(self.entry_player1Depth.get())
+        self.player1Time = float(self.entry_player1Time.get())
         self.player2Type = self.tk_player2Type.get()
         self.player2Depth = int(self.entry_player2Depth.get())
+        self.player2Time = float(self.entry_player2Time.get())
 
         self.frame.destroy()
 
     def GetGameSetupParams(self):
         self.root.wait_window(self.frame)  # waits for frame to be destroyed
         self.root.destroy()  # noticed that with "text" gui mode, the tk window stayed...this gets rid of it.
-        return self.player1Type, self.player1Depth, self.player2Type, self.player2Depth
+        return self.player1Type, self.player1Depth, self.player1Time, \
+               self.player2Type, self.player2Depth, self.player2Time
 
 
 if __name__ == "__main__":
@@ -0,0 +1,350 @@
+#! /usr/bin/env python
+"""
+ Project: Python Chess
+ File name: ChessServer.py
+ Description:  Headless game server.  Hosts many games at once on a local
+	TCP or Unix socket, one JSON object per line in each direction.  The
+	engine searches run in a pool of worker processes and the event loop
+	only polls them, so a slow search never holds up the other sessions.
+	Every session has its own move time, capped by the server.
+
+	Requests (a reply carries the request's "id" when one was sent):
+	  {"cmd": "new", "fen": "...", "moveTime": 2.0}  -> {"session": 1, "fen": ..., ...}
+	  {"cmd": "move", "session": 1, "move": "e2e4"}  -> {"session": 1, "fen": ..., "result": "*"}
+	  {"cmd": "go", "session": 1}                    -> {"session": 1, "move": "e7e5", "nodes": ..., ...}
+	  {"cmd": "show", "session": 1}                  -> {"session": 1, "fen": ..., "moves": [...], ...}
+	  {"cmd": "close", "session": 1}                 -> {"session": 1, "closed": true}
+	Failed requests are answered with {"error": "..."}.  Sessions belong to
+	the connection that created them and end with it.
+
+	Backpressure: a connection is not read while it has MAX_PENDING
+	searches outstanding or more than MAX_OUTPUT bytes of replies waiting,
+	so a client that floods requests is slowed down by TCP instead of
+	queueing unbounded work, and new connections stay in the listen
+	backlog while --max-connections are open.
+
+	Every search starts a fresh engine.  With --tt-file the engines share
+	a transposition table file, which keeps what they searched across
+	requests and server restarts.
+
+	Examples:
+	  python ChessServer.py --port 7000 -j 4 --tt-file data/server.tt
+	  python ChessServer.py --unix /tmp/chess.sock --move-time 1
+ """
+
+import asynchat
+import asyncore
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import timeit
+from optparse import OptionParser
+
+import chess
+
+from AI import AI
+
+MAX_LINE = 8192  # longest request accepted, in bytes
+MAX_PENDING = 4  # searches one connection may have running or queued
+MAX_OUTPUT = 1 << 16  # unsent reply bytes after which a connection is not read
+POLL_INTERVAL = 0.02  # seconds between checks for finished searches
+
+
+class RequestError(Exception):
+    pass
+
+
+def _initWorker():
+    # Ctrl-C is handled by the server process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def searchPosition(task):
+    # runs in a pool worker; returns the engine's move for the position
+    fen, moves, moveTime, ttPath = task
+    board = chess.Board(fen)
+    for uci in moves:
+        board.push_uci(uci)
+    ai = AI(board, board.turn, moveTime=moveTime, ttPath=ttPath)
+    move = ai.GetNextMove()
+    return move.uci(), ai.nodes, ai.depthReached
+
+
+class Session:
+    def __init__(self, sessionId, connection, fen, moveTime):
+        self.id = sessionId
+        self.connection = connection
+        self.startFen = fen
+        self.board = chess.Board(fen)
+        self.moveTime = moveTime
+        # AsyncResult of the running search, the id of the "go" it answers
+        # and when it was started
+        self.search = None
+        self.requestId = None
+        self.searchStart = None
+
+    def state(self):
+        board = self.board
+        return {'session': self.id,
+                'fen': board.fen(),
+                'turn': 'white' if board.turn == chess.WHITE else 'black',
+                'result': board.result(),
+                'moveTime': self.moveTime}
+
+
+class ChessConnection(asynchat.async_chat):
+    def __init__(self, sock, server):
+        asynchat.async_chat.__init__(self, sock)
+        self.server = server
+        self.incoming = []
+        self.incomingSize = 0
+        self.sessions = set()
+        self.pending = 0
+        # set once an oversized request is answered; nothing more is read
+        self.closing = False
+        self.set_terminator('\n')
+
+    def collect_incoming_data(self, data):
+        self.incoming.append(data)
+        self.incomingSize += len(data)
+        if self.incomingSize > MAX_LINE:
+            self.incoming = []
+            self.incomingSize = 0
+            self.reply(None, error='request too long')
+            self.closing = True
+            self.close_when_done()
+
+    def found_terminator(self):
+        line = ''.join(self.incoming).strip()
+        self.incoming = []
+        self.incomingSize = 0
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self.reply(None, error='request is not JSON')
+            return
+        if not isinstance(request, dict):
+            self.reply(None, error='request is not a JSON object')
+            return
+        self.server.handleRequest(self, request)
+
+    def readable(self):
+        if self.closing or self.pending >= MAX_PENDING:
+            return False
+        # close_when_done() queues a None
+        if sum(len(data) for data in self.producer_fifo if data is not None) > MAX_OUTPUT:
+            return False
+        return asynchat.async_chat.readable(self)
+
+    def reply(self, requestId, **fields):
+        if requestId is not None:
+            fields['id'] = requestId
+        self.push(json.dumps(fields) + '\n')
+
+    def close(self):
+        # every way a connection ends comes through here
+        self.server.dropConnection(self)
+        asynchat.async_chat.close(self)
+
+
+class ChessServer(asyncore.dispatcher):
+    def __init__(self, address, family=socket.AF_INET, workers=None, maxSessions=256, maxConnections=64,
+                 moveTime=2.0, maxMoveTime=30.0, ttPath=None):
+        asyncore.dispatcher.__init__(self)
+        self.create_socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.set_reuse_addr()
+        self.bind(address)
+        self.listen(16)
+
+        self.pool = multiprocessing.Pool(workers, _initWorker)
+        self.maxSessions = maxSessions
+        self.maxConnections = maxConnections
+        self.moveTime = moveTime
+        self.maxMoveTime = maxMoveTime
+        self.ttPath = ttPath
+        self.connections = set()
+        self.sessions = {}
+        self.nextSession = 1
+        self.commands = {'new': self.newSession,
+                         'move': self.playMove,
+                         'go': self.startSearch,
+                         'show': self.showSession,
+                         'close': self.closeSession}
+
+    def readable(self):
+        # over the limit, connections wait in the listen backlog
+        return len(self.connections) < self.maxConnections
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        self.connections.add(ChessConnection(pair[0], self))
+
+    def dropConnection(self, connection):
+        for sessionId in list(connection.sessions):
+            self.removeSession(self.sessions[sessionId])
+        self.connections.discard(connection)
+
+    def handleRequest(self, connection, request):
+        requestId = request.get('id')
+        handler = self.commands.get(request.get('cmd'))
+        try:
+            if handler is None:
+                raise RequestError('unknown command, expected one of: ' + ', '.join(sorted(self.commands)))
+            handler(connection, requestId, request)
+        except RequestError as e:
+            connection.reply(requestId, error=str(e))
+
+    def getSession(self, connection, request):
+        session = self.sessions.get(request.get('session'))
+        if session is None or session.connection is not connection:
+            raise RequestError('no such session')
+        return session
+
+    def newSession(self, connection, requestId, request):
+        if len(self.sessions) >= self.maxSessions:
+            raise RequestError('too many sessions')
+        fen = request.get('fen', chess.STARTING_FEN)
+        try:
+            board = chess.Board(fen)
+        except ValueError:
+            raise RequestError('invalid FEN')
+        if not board.is_valid():
+            raise RequestError('invalid position')
+        moveTime = request.get('moveTime', self.moveTime)
+        if not isinstance(moveTime, (int, float)) or isinstance(moveTime, bool) or moveTime <= 0:
+            raise RequestError('moveTime must be a positive number of seconds')
+
+        session = Session(self.nextSession, connection, board.fen(), min(moveTime, self.maxMoveTime))
+        self.nextSession += 1
+        self.sessions[session.id] = session
+        connection.sessions.add(session.id)
+        connection.reply(requestId, **session.state())
+
+    def playMove(self, connection, requestId, request):
+        session = self.getSession(connection, request)
+        if session.search is not None:
+            raise RequestError('the engine is thinking')
+        try:
+            move = chess.Move.from_uci(str(request.get('move')))
+        except ValueError:
+            raise RequestError('moves are given in UCI notation, e.g. e2e4')
+        if move not in session.board.legal_moves:
+            raise RequestError('illegal move')
+        session.board.push(move)
+        connection.reply(requestId, **session.state())
+
+    def startSearch(self, connection, requestId, request):
+        session = self.getSession(connection, request)
+        if session.search is not None:
+            raise RequestError('the engine is already thinking')
+        if session.board.is_game_over():
+            raise RequestError('the game is over')
+        task = (session.startFen, [move.uci() for move in session.board.move_stack], session.moveTime,
+                self.ttPath)
+        session.search = self.pool.apply_async(searchPosition, (task,))
+        session.requestId = requestId
+        session.searchStart = timeit.default_timer()
+        connection.pending += 1
+
+    def finishSearch(self, session):
+        connection = session.connection
+        result = session.search
+        requestId = session.requestId
+        elapsed = timeit.default_timer() - session.searchStart
+        session.search = None
+        connection.pending -= 1
+        try:
+            uci, nodes, depth = result.get()
+        except Exception as e:
+            connection.reply(requestId, session=session.id, error='search failed: %s' % e)
+            return
+        session.board.push_uci(uci)
+        state = session.state()
+        state.update(move=uci, nodes=nodes, depth=depth, time=round(elapsed, 3))
+        connection.reply(requestId, **state)
+
+    def showSession(self, connection, requestId, request):
+        session = self.getSession(connection, request)
+        state = session.state()
+        state.update(moves=[move.uci() for move in session.board.move_stack],
+                     thinking=session.search is not None)
+        connection.reply(requestId, **state)
+
+    def closeSession(self, connection, requestId, request):
+        session = self.getSession(connection, request)
+        self.removeSession(session)
+        connection.reply(requestId, session=session.id, closed=True)
+
+    def removeSession(self, session):
+        # a running search is left to finish in its worker, its result is dropped
+        if session.search is not None:
+            session.search = None
+            session.connection.pending -= 1
+        session.connection.sessions.discard(session.id)
+        del self.sessions[session.id]
+
+    def pollSearches(self):
+        for session in self.sessions.values():
+            if session.search is not None and session.search.ready():
+                self.finishSearch(session)
+
+    def serveForever(self):
+        try:
+            while True:
+                asyncore.loop(POLL_INTERVAL, count=1)
+                self.pollSearches()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            for connection in list(self.connections):
+                connection.close()
+            self.close()
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--host", dest="host", default="127.0.0.1", help="Address to listen on")
+    parser.add_option("--port", dest="port", type="int", default=7000, help="TCP port to listen on")
+    parser.add_option("--unix", dest="unix", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_option("-j", dest="workers", type="int", default=multiprocessing.cpu_count(),
+                      help="Number of searches run at the same time")
+    parser.add_option("--max-sessions", dest="max_sessions", type="int", default=256,
+                      help="Games hosted at the same time")
+    parser.add_option("--max-connections", dest="max_connections", type="int", default=64,
+                      help="Connections served at the same time")
+    parser.add_option("--move-time", dest="move_time", type="float", default=2.0,
+                      help="Default seconds per engine move")
+    parser.add_option("--max-move-time", dest="max_move_time", type="float", default=30.0,
+                      help="Upper limit of a session's seconds per engine move")
+    parser.add_option("--tt-file", dest="tt_file", default=None,
+                      help="Transposition table file shared by the searches")
+    (options, args) = parser.parse_args()
+
+    if options.unix:
+        if os.path.exists(options.unix):
+            os.remove(options.unix)
+        family, address = socket.AF_UNIX, options.unix
+    else:
+        family, address = socket.AF_INET, (options.host, options.port)
+
+    server = ChessServer(address, family, options.workers, options.max_sessions, options.max_connections,
+                         options.move_time, options.max_move_time, options.tt_file)
+    print 'listening on %s' % (address,)
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if options.unix and os.path.exists(options.unix):
+            os.remove(options.unix)
+
+
+if __name__ == '__main__':
+    main()
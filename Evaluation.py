@@ -0,0 +1,278 @@
+"""
+ Project: Python Chess
+ File name: Evaluation.py
+ Description:  Incremental static evaluation for the AI search.
+	The evaluator follows the search's Position: it is told about every
+	move before it is made and about every unmake, and keeps the material
+	balance (and optionally a piece-square bonus) up to date, so scoring
+	a leaf is a lookup instead of a recount of the whole board.
+
+	BatchEvaluator scores all the children of a node at once: their
+	boards are stacked into one array and evaluated with NumPy, so the
+	interpreter overhead is paid per batch instead of per leaf.  It has
+	the same interface, and MaterialEvaluator.evaluateMoves() gives the
+	scalar results to check it against.  NumPy is optional and only
+	needed for BatchEvaluator.
+ """
+
+import chess
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from Position import WHITE, PAWN, ROOK, KING, PIECE_MASK, NULL_MOVE, MAX_DEPTH
+
+PIECE_VALUES = [0, 10, 30, 30, 50, 90, 2000]
+
+# Piece-square tables in the usual "simplified evaluation" layout: a8 first,
+# h1 last, seen from White's side, in hundredths of a pawn.  They are scaled
+# to PIECE_VALUES units (a pawn is 10) when the evaluator is built.
+PAWN_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0]
+
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+
+ROOK_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0]
+
+QUEEN_TABLE = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20]
+
+KING_TABLE = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20]
+
+TABLES = [None, PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE]
+
+
+def buildPieceSquareTables():
+    # pst[color][piece_type][square] in PIECE_VALUES units, indexed by
+    # python-chess square numbers (a1 = 0)
+    pst = [[None] * 7, [None] * 7]
+    for pieceType in chess.PIECE_TYPES:
+        table = TABLES[pieceType]
+        white = [0] * 64
+        black = [0] * 64
+        for square in chess.SQUARES:
+            rank = chess.square_rank(square)
+            fileIndex = chess.square_file(square)
+            white[square] = int(round(table[(7 - rank) * 8 + fileIndex] / 10.0))
+            black[square] = int(round(table[rank * 8 + fileIndex] / 10.0))
+        pst[chess.WHITE][pieceType] = white
+        pst[chess.BLACK][pieceType] = black
+    return pst
+
+
+class MaterialEvaluator:
+    def __init__(self, pieceSquareTables=False):
+        self.pst = buildPieceSquareTables() if pieceSquareTables else None
+        # both terms are White minus Black
+        self.material = 0
+        self.positional = 0
+        # the terms before each move on the search path, by ply
+        self.depth = 0
+        self.materials = [0] * MAX_DEPTH
+        self.positionals = [0] * MAX_DEPTH
+
+    def reset(self, position):
+        # full recount, only needed when the evaluator starts following a position
+        material = 0
+        positional = 0
+        pst = self.pst
+        for square, piece in enumerate(position.squares):
+            if piece:
+                color = piece >> 3
+                pieceType = piece & PIECE_MASK
+                sign = 1 if color == WHITE else -1
+                material += sign * PIECE_VALUES[pieceType]
+                if pst is not None:
+                    positional += sign * pst[color][pieceType][square]
+        self.material = material
+        self.positional = positional
+        self.depth = 0
+
+    def push(self, position, move):
+        # must be called before position.makeMove(move)
+        depth = self.depth
+        self.materials[depth] = self.material
+        self.positionals[depth] = self.positional
+        self.depth = depth + 1
+        if move == NULL_MOVE:
+            return
+
+        color = position.turn
+        sign = 1 if color == WHITE else -1
+        squares = position.squares
+        pst = self.pst
+        fromSquare = move & 63
+        toSquare = move >> 6 & 63
+        promotion = move >> 12
+        pieceType = squares[fromSquare] & PIECE_MASK
+
+        captureSquare = toSquare
+        captured = squares[toSquare] & PIECE_MASK
+        if not captured and pieceType == PAWN and toSquare == position.ep and (fromSquare - toSquare) & 7:
+            captured = PAWN
+            captureSquare += -8 if color == WHITE else 8
+
+        material = PIECE_VALUES[captured]
+        positional = 0
+        if captured and pst is not None:
+            positional += pst[color ^ 1][captured][captureSquare]
+
+        if promotion:
+            material += PIECE_VALUES[promotion] - PIECE_VALUES[PAWN]
+
+        if pst is not None:
+            placed = promotion or pieceType
+            positional += pst[color][placed][toSquare] - pst[color][pieceType][fromSquare]
+            if pieceType == KING and (toSquare - fromSquare == 2 or fromSquare - toSquare == 2):
+                # castling also moves the rook
+                if toSquare > fromSquare:
+                    rookFrom, rookTo = fromSquare + 3, fromSquare + 1
+                else:
+                    rookFrom, rookTo = fromSquare - 4, fromSquare - 1
+                rookTable = pst[color][ROOK]
+                positional += rookTable[rookTo] - rookTable[rookFrom]
+
+        self.material += sign * material
+        self.positional += sign * positional
+
+    def pop(self):
+        # must be called together with position.unmakeMove()
+        depth = self.depth - 1
+        self.depth = depth
+        self.material = self.materials[depth]
+        self.positional = self.positionals[depth]
+
+    def evaluate(self, color):
+        # static score of the current position from color's point of view
+        score = self.material + self.positional
+        return score if color == chess.WHITE else -score
+
+    def materialBalance(self, color):
+        return self.material if color == chess.WHITE else -self.material
+
+    def evaluateMoves(self, position, moves):
+        # static scores of the positions after each of moves, each from the
+        # point of view of the side to move there
+        scores = []
+        for move in moves:
+            self.push(position, move)
+            position.makeMove(move)
+            scores.append(self.evaluate(position.turn))
+            position.unmakeMove()
+            self.pop()
+        return scores
+
+
+class BatchEvaluator(MaterialEvaluator):
+    # material and piece-square scores as one table lookup over stacked
+    # mailboxes: table[piece][square] is what a piece on a square adds,
+    # White minus Black.  A linear evaluator is the same product with other
+    # weights, a small network one more matrix product on top
+    def __init__(self, pieceSquareTables=False):
+        if numpy is None:
+            raise ImportError('the batch evaluator needs numpy')
+        MaterialEvaluator.__init__(self, pieceSquareTables)
+        table = numpy.zeros((16, 64), dtype=numpy.int64)
+        for color in (chess.WHITE, chess.BLACK):
+            sign = 1 if color == chess.WHITE else -1
+            for pieceType in chess.PIECE_TYPES:
+                for square in chess.SQUARES:
+                    value = PIECE_VALUES[pieceType]
+                    if self.pst is not None:
+                        value += self.pst[color][pieceType][square]
+                    table[pieceType | int(color) << 3, square] = sign * value
+        self.table = table
+        self.squareIndex = numpy.arange(64)
+
+    def scoreBoards(self, boards):
+        # White-minus-Black scores of a stack of mailboxes, one row of 64 piece codes per position
+        return self.table[boards, self.squareIndex].sum(axis=1)
+
+    def evaluateMoves(self, position, moves):
+        if not moves:
+            return []
+        # the children's mailboxes: the parent's, with the squares each move changes written over
+        boards = numpy.tile(numpy.array(position.squares, dtype=numpy.int8), (len(moves), 1))
+        rows = []
+        columns = []
+        pieces = []
+        us = position.turn
+        squares = position.squares
+        ep = position.ep
+        for row, move in enumerate(moves):
+            fromSquare = move & 63
+            toSquare = move >> 6 & 63
+            piece = squares[fromSquare]
+            pieceType = piece & PIECE_MASK
+            placed = (move >> 12 | us << 3) if move >> 12 else piece
+            rows += (row, row)
+            columns += (fromSquare, toSquare)
+            pieces += (0, placed)
+            if pieceType == PAWN and toSquare == ep and ep:
+                rows.append(row)
+                columns.append(toSquare - 8 if us == WHITE else toSquare + 8)
+                pieces.append(0)
+            elif pieceType == KING and (toSquare - fromSquare == 2 or fromSquare - toSquare == 2):
+                if toSquare > fromSquare:
+                    rookFrom, rookTo = fromSquare + 3, fromSquare + 1
+                else:
+                    rookFrom, rookTo = fromSquare - 4, fromSquare - 1
+                rows += (row, row)
+                columns += (rookFrom, rookTo)
+                pieces += (0, ROOK | us << 3)
+        boards[rows, columns] = pieces
+        scores = self.scoreBoards(boards)
+        # after the moves the other side is to move
+        if us == WHITE:
+            scores = -scores
+        return scores.tolist()
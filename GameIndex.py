@@ -0,0 +1,343 @@
+#! /usr/bin/env python
+"""
+ Project: Python Chess
+ File name: GameIndex.py
+ Description:  Position index built from PGN game archives.  The files are
+	streamed game by game, never read whole, and split into chunks at game
+	boundaries that a pool of worker processes parses in parallel.  Every
+	main line position up to --max-ply is keyed by its polyglot Zobrist
+	hash, and the moves played from it are counted by game result.  The
+	counts go to an SQLite file that later runs add to, so an archive can
+	be indexed a file at a time.  The index remembers how many bytes of
+	each file it holds, and a file that has grown since is only read from
+	there on; files are expected to grow by whole games at their end.
+
+	The index then serves as an opening book: AI(indexPath=...) plays the
+	moves that scored best for the side to move from it.
+
+	Examples:
+	  python GameIndex.py -j 8 archive1.pgn archive2.pgn
+	  python GameIndex.py --lookup "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+ """
+
+import atexit
+import multiprocessing
+import os
+import random
+import signal
+import sqlite3
+import timeit
+from optparse import OptionParser
+
+import chess
+import chess.pgn
+from chess import polyglot
+
+from Position import fromBoard, packMove, toMove, MAX_DEPTH
+
+INDEX_PATH = os.path.join('data', 'games.db')
+# plies of every game that are indexed
+MAX_PLY = 30
+# bytes of PGN a worker parses at a time
+CHUNK_SIZE = 16 << 20
+# games a move needs in the index before it is played from it
+MIN_GAMES = 2
+
+# counted results, in the order of the count columns
+RESULTS = {'1-0': 0, '1/2-1/2': 1, '0-1': 2}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS moves (
+    key INTEGER NOT NULL,
+    move INTEGER NOT NULL,
+    white INTEGER NOT NULL,
+    draws INTEGER NOT NULL,
+    black INTEGER NOT NULL,
+    PRIMARY KEY (key, move)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    offset INTEGER NOT NULL,
+    games INTEGER NOT NULL
+);
+'''
+
+# open indexes by absolute path
+_indexes = {}
+
+
+def signedKey(key):
+    # SQLite integers are signed 64 bit
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class GameVisitor(chess.pgn.BaseVisitor):
+    # collects the result and the main line (key, move) pairs of one game,
+    # without building the game tree.  The keys come incrementally from a
+    # Position that follows the main line, which can go MAX_DEPTH plies;
+    # subclasses may store the moves differently through entry
+    def __init__(self, maxPly=MAX_PLY):
+        self.maxPly = min(maxPly, MAX_DEPTH)
+        self.position = None
+        self.headerResult = None
+        self.gameResult = None
+        self.moves = []
+        self.variations = 0
+        self.broken = False
+
+    def visit_header(self, tagname, tagvalue):
+        if tagname == 'Result':
+            self.headerResult = tagvalue
+        elif tagname == 'Variant' and tagvalue.lower() not in ('standard', 'chess'):
+            self.broken = True
+
+    def visit_move(self, board, move):
+        if self.variations or self.broken or len(self.moves) >= self.maxPly:
+            return
+        if self.position is None:
+            try:
+                self.position = fromBoard(board)
+            except ValueError:
+                self.broken = True
+                return
+        move = packMove(move)
+        self.moves.append(self.entry(move))
+        self.position.makeMove(move)
+
+    def entry(self, move):
+        # what is recorded of a packed move, from self.position before it is made
+        return self.position.key, move
+
+    def begin_variation(self):
+        self.variations += 1
+
+    def end_variation(self):
+        self.variations -= 1
+
+    def visit_result(self, result):
+        self.gameResult = result
+
+    def handle_error(self, error):
+        # a game with an unreadable move is left out
+        self.broken = True
+
+    def result(self):
+        return self
+
+
+def readGames(handle, end=None, maxPly=MAX_PLY, Visitor=GameVisitor):
+    # yields a Visitor for every game of an open PGN file, from its
+    # current offset up to the first game that starts at or after end
+    while True:
+        offset = handle.tell()
+        line = handle.readline()
+        while line and line.isspace():
+            offset = handle.tell()
+            line = handle.readline()
+        if not line or (end is not None and offset >= end):
+            return
+        handle.seek(offset)
+        game = chess.pgn.read_game(handle, Visitor=lambda: Visitor(maxPly))
+        if game is None:
+            return
+        yield game
+
+
+def splitFile(path, chunkSize=CHUNK_SIZE, marker='[Event ', start=0):
+    # (start, end) byte ranges of path from start on, that begin on a line
+    # starting with marker; none if the file ends before start
+    size = os.path.getsize(path)
+    if size <= start:
+        return []
+    starts = [start]
+    with open(path) as handle:
+        offset = start + chunkSize
+        while offset < size:
+            handle.seek(offset)
+            handle.readline()
+            while True:
+                offset = handle.tell()
+                line = handle.readline()
+                if not line or line.startswith(marker):
+                    break
+            if not line:
+                break
+            starts.append(offset)
+            offset += chunkSize
+    return zip(starts, starts[1:] + [size])
+
+
+def _initWorker():
+    # Ctrl-C is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def indexChunk(task):
+    # runs in a pool worker; counts the moves of the games of one chunk
+    path, start, end, maxPly = task
+    counts = {}
+    games = skipped = 0
+    with open(path) as handle:
+        handle.seek(start)
+        for game in readGames(handle, end, maxPly):
+            result = RESULTS.get(game.gameResult or game.headerResult)
+            if game.broken or result is None:
+                skipped += 1
+                continue
+            games += 1
+            for entry in game.moves:
+                count = counts.get(entry)
+                if count is None:
+                    count = counts[entry] = [0, 0, 0]
+                count[result] += 1
+    return path, counts, games, skipped
+
+
+class GameIndex:
+    def __init__(self, path, minGames=MIN_GAMES):
+        self.path = path
+        self.minGames = minGames
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        # the connection is opened lazily and again in a forked process,
+        # which may not use its parent's
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path)
+            self.connection.executescript(SCHEMA)
+            self.pid = os.getpid()
+        return self.connection
+
+    def source(self, path):
+        # (bytes, games) of this file already in the index
+        row = self.connect().execute('SELECT offset, games FROM sources WHERE path = ?',
+                                     (os.path.abspath(path),)).fetchone()
+        return tuple(row) if row is not None else (0, 0)
+
+    def add(self, counts):
+        # adds {(key, move): [white, draws, black]} to the index
+        connection = self.connect()
+        rows = [(signedKey(key), move) for key, move in counts]
+        connection.executemany('INSERT OR IGNORE INTO moves VALUES (?, ?, 0, 0, 0)', rows)
+        connection.executemany('UPDATE moves SET white = white + ?, draws = draws + ?, black = black + ? '
+                               'WHERE key = ? AND move = ?',
+                               [tuple(count) + row for row, count in zip(rows, counts.itervalues())])
+
+    def setSource(self, path, offset, games):
+        self.connect().execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)',
+                               (os.path.abspath(path), offset, games))
+
+    def commit(self):
+        self.connect().commit()
+
+    def lookup(self, board):
+        # [(move, white, draws, black)] of the legal moves played from board, most played first
+        if not os.path.isfile(self.path):
+            return []
+        rows = self.connect().execute('SELECT move, white, draws, black FROM moves WHERE key = ?',
+                                      (signedKey(polyglot.zobrist_hash(board)),)).fetchall()
+        stats = [(toMove(move), white, draws, black) for move, white, draws, black in rows]
+        stats = [entry for entry in stats if entry[0] in board.legal_moves]
+        stats.sort(key=lambda entry: -sum(entry[1:]))
+        return stats
+
+    def choose(self, board, selection='weighted', rng=random):
+        # returns a move for board, or None when the position is not in the index.
+        # Moves are weighted like polyglot book entries, two per game the side
+        # to move won and one per draw; selection is 'weighted' or 'best'
+        choices = []
+        for move, white, draws, black in self.lookup(board):
+            if white + draws + black < self.minGames:
+                continue
+            wins = white if board.turn == chess.WHITE else black
+            if 2 * wins + draws > 0:
+                choices.append((2 * wins + draws, move))
+        if not choices:
+            return None
+        if selection == 'best':
+            return max(choices, key=lambda choice: choice[0])[1]
+        pick = rng.randint(1, sum(weight for weight, move in choices))
+        for weight, move in choices:
+            pick -= weight
+            if pick <= 0:
+                return move
+
+    def close(self):
+        if self.connection is not None and self.pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+
+
+def getIndex(path=INDEX_PATH):
+    path = os.path.abspath(path)
+    if path not in _indexes:
+        _indexes[path] = GameIndex(path)
+    return _indexes[path]
+
+
+def closeIndexes():
+    for index in _indexes.values():
+        index.close()
+    _indexes.clear()
+
+
+atexit.register(closeIndexes)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] FILE.pgn ...")
+    parser.add_option("-o", dest="index", default=INDEX_PATH, help="Index file the counts are added to")
+    parser.add_option("-j", dest="workers", type="int", default=multiprocessing.cpu_count(),
+                      help="Number of chunks parsed at the same time")
+    parser.add_option("--max-ply", dest="max_ply", type="int", default=MAX_PLY,
+                      help="Plies of every game that are indexed")
+    parser.add_option("--chunk-size", dest="chunk_size", type="int", default=CHUNK_SIZE >> 20,
+                      help="Megabytes of PGN parsed by a worker at a time")
+    parser.add_option("--lookup", dest="lookup", default=None,
+                      help="Print the moves of the index for this FEN instead")
+    (options, args) = parser.parse_args()
+
+    index = getIndex(options.index)
+    if options.lookup:
+        board = chess.Board(options.lookup)
+        for move, white, draws, black in index.lookup(board):
+            print '%-7s %8d games  +%d =%d -%d' % (board.san(move), white + draws + black, white, draws, black)
+        return
+
+    start = timeit.default_timer()
+    pool = multiprocessing.Pool(options.workers, _initWorker)
+    try:
+        totalGames = totalSkipped = 0
+        for path in args:
+            # the games are added from where the last run stopped
+            offset, games = index.source(path)
+            if os.path.getsize(path) < offset:
+                print '%s: smaller than the %d bytes indexed, it needs a new index' % (path, offset)
+                continue
+            chunks = splitFile(path, max(options.chunk_size, 1) << 20, start=offset)
+            if not chunks:
+                print '%s: already indexed' % path
+                continue
+            tasks = [(path, chunkStart, chunkEnd, options.max_ply) for chunkStart, chunkEnd in chunks]
+            fileGames = 0
+            for path, counts, chunkGames, skipped in pool.imap_unordered(indexChunk, tasks):
+                index.add(counts)
+                fileGames += chunkGames
+                totalSkipped += skipped
+            # the counts and the offset go in together, so that an
+            # interrupted run leaves the file as it was
+            index.setSource(path, chunks[-1][1], games + fileGames)
+            index.commit()
+            totalGames += fileGames
+            print '%s: %d games added, %d in all' % (path, fileGames, games + fileGames)
+    finally:
+        pool.terminate()
+        pool.join()
+    elapsed = timeit.default_timer() - start
+    print '%d games indexed, %d skipped, in %.1fs (%.0f games/s)' % (
+        totalGames, totalSkipped, elapsed, totalGames / max(elapsed, 1e-9))
+
+
+if __name__ == '__main__':
+    main()
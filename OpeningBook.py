@@ -0,0 +1,61 @@
+"""
+ Project: Python Chess
+ File name: OpeningBook.py
+ Description:  Process-wide polyglot opening book service.  Each book file
+	is memory mapped once, shared by every engine in the process (and by
+	forked worker processes), and closed when the process exits.
+ """
+
+import atexit
+import os
+import random
+
+from chess import polyglot
+
+BOOK_PATH = os.path.join('data', 'komodo.bin')
+
+# open books by absolute path
+_books = {}
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        if os.path.isfile(path):
+            self.reader = polyglot.MemoryMappedReader(path)
+
+    def choose(self, board, selection='weighted', rng=random):
+        # returns a book move for board, or None when the position is not in the book.
+        # selection is 'weighted' (random, by entry weight) or 'best' (highest weight)
+        if self.reader is None:
+            return None
+        try:
+            if selection == 'best':
+                entry = self.reader.find(board)
+            else:
+                entry = self.reader.weighted_choice(board, random=rng)
+        except IndexError:
+            return None
+        return entry.move()
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+def getBook(path=BOOK_PATH):
+    path = os.path.abspath(path)
+    if path not in _books:
+        _books[path] = OpeningBook(path)
+    return _books[path]
+
+
+def closeBooks():
+    for book in _books.values():
+        book.close()
+    _books.clear()
+
+
+atexit.register(closeBooks)
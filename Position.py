@@ -0,0 +1,579 @@
+"""
+ Project: Python Chess
+ File name: Position.py
+ Description:  Compact position for the AI search.  The pieces are kept
+	as plain int bitboards plus a 64-square mailbox, all in __slots__,
+	and moves are packed into ints (from | to << 6 | promotion << 12).
+	makeMove/unmakeMove write the undo information into arrays that are
+	allocated once, so walking the tree creates no move or board
+	objects, and the polyglot Zobrist key is kept up to date on the way.
+	The move generator is pseudo-legal: a move is legal when it does not
+	leave the mover's king attacked after it is made.
+
+	chess.Board is only used at the boundary: fromBoard() builds a
+	Position, toBoard() and toMove() turn it and its moves back.
+	Standard chess only, no Chess960.
+ """
+
+import chess
+from chess import polyglot
+
+WHITE = 1
+BLACK = 0
+
+PAWN = chess.PAWN
+KNIGHT = chess.KNIGHT
+BISHOP = chess.BISHOP
+ROOK = chess.ROOK
+QUEEN = chess.QUEEN
+KING = chess.KING
+
+# a piece is its type with the color in bit 3: black 1-6, white 9-14
+WHITE_PIECE = 8
+PIECE_MASK = 7
+
+# castling rights bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+# the packed null move (a1a1 is never a real move)
+NULL_MOVE = 0
+
+# deepest line makeMove can follow from the position it was built from
+MAX_DEPTH = 256
+
+# a position can only have occurred five times if the last 16 plies were
+# reversible (it takes at least four plies to come back to a position)
+FIVEFOLD_PLIES = 16
+
+BB_ALL = chess.BB_ALL
+BB_SQUARES = chess.BB_SQUARES
+BB_FILE_A = chess.BB_FILE_A
+BB_FILE_H = chess.BB_FILE_H
+BB_RANK_1 = chess.BB_RANK_1
+BB_RANK_3 = chess.BB_RANK_3
+BB_RANK_6 = chess.BB_RANK_6
+BB_RANK_8 = chess.BB_RANK_8
+BB_DARK_SQUARES = chess.BB_DARK_SQUARES
+BB_LIGHT_SQUARES = chess.BB_LIGHT_SQUARES
+KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
+KING_ATTACKS = chess.BB_KING_ATTACKS
+PAWN_ATTACKS = chess.BB_PAWN_ATTACKS
+DIAG_MASKS = chess.BB_DIAG_MASKS
+DIAG_ATTACKS = chess.BB_DIAG_ATTACKS
+FILE_MASKS = chess.BB_FILE_MASKS
+FILE_ATTACKS = chess.BB_FILE_ATTACKS
+RANK_MASKS = chess.BB_RANK_MASKS
+RANK_ATTACKS = chess.BB_RANK_ATTACKS
+
+# square of a one-bit bitboard
+SQUARE_OF = dict((bb, square) for square, bb in enumerate(BB_SQUARES))
+
+# castling rights kept when a move starts or ends on a square
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[chess.E1] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[chess.H1] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASK[chess.A1] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASK[chess.E8] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[chess.H8] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASK[chess.A8] = 15 & ~BLACK_QUEENSIDE
+
+# polyglot Zobrist keys by piece and square, castling rights, en passant file
+RANDOM = polyglot.POLYGLOT_RANDOM_ARRAY
+PIECE_KEYS = [[0] * 64 for piece in range(16)]
+for _color in (WHITE, BLACK):
+    for _pieceType in range(PAWN, KING + 1):
+        PIECE_KEYS[_pieceType | _color << 3] = [RANDOM[64 * ((_pieceType - 1) * 2 + _color) + square]
+                                                for square in range(64)]
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & 1 << _bit:
+            CASTLING_KEYS[_rights] ^= RANDOM[768 + _bit]
+EP_KEYS = [RANDOM[772 + chess.square_file(square)] for square in range(64)]
+TURN_KEY = RANDOM[780]
+
+
+def packMove(move):
+    # chess.Move to packed int
+    if not move:
+        return NULL_MOVE
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def toMove(move):
+    # packed int to chess.Move
+    if move == NULL_MOVE:
+        return chess.Move.null()
+    return chess.Move(move & 63, move >> 6 & 63, move >> 12 or None)
+
+
+def fromBoard(board):
+    # Position of a standard chess board; the search can follow MAX_DEPTH plies from it
+    if board.chess960:
+        raise ValueError('Chess960 positions are not supported')
+    position = Position()
+    for square in chess.SQUARES:
+        piece = board.piece_at(square)
+        if piece:
+            position.putPiece(square, piece.piece_type | int(piece.color) << 3)
+    position.turn = int(board.turn)
+    rights = board.clean_castling_rights()
+    castling = 0
+    for bb, bit in ((chess.BB_H1, WHITE_KINGSIDE), (chess.BB_A1, WHITE_QUEENSIDE),
+                    (chess.BB_H8, BLACK_KINGSIDE), (chess.BB_A8, BLACK_QUEENSIDE)):
+        if rights & bb:
+            castling |= bit
+    position.castling = castling
+    position.ep = board.ep_square or 0
+    position.halfmove = board.halfmove_clock
+    position.fullmove = board.fullmove_number
+    position.key = position.computeKey()
+    # keys of the positions since the last capture or pawn move, all that a
+    # repetition count looks at, oldest first
+    history = board.copy()
+    keys = []
+    while history.move_stack and len(keys) < board.halfmove_clock:
+        history.pop()
+        keys.append(polyglot.zobrist_hash(history))
+    keys.reverse()
+    position.history = keys
+    return position
+
+
+class Position(object):
+    __slots__ = ('bb', 'occ', 'squares', 'turn', 'castling', 'ep', 'halfmove', 'fullmove', 'key', 'history',
+                 'ply', 'undoMove', 'undoCaptured', 'undoCastling', 'undoEp', 'undoHalfmove', 'undoKey')
+
+    def __init__(self):
+        # an empty board, white to move; see fromBoard()
+        self.bb = [0] * 16
+        self.occ = [0, 0]
+        self.squares = [0] * 64
+        self.turn = WHITE
+        self.castling = 0
+        # en passant target square after a double pawn push, else 0
+        self.ep = 0
+        self.halfmove = 0
+        self.fullmove = 1
+        self.key = 0
+        # keys of the game's positions before this one, for repetitions
+        self.history = []
+        # moves made since the position was built, and what they undo
+        self.ply = 0
+        self.undoMove = [0] * MAX_DEPTH
+        self.undoCaptured = [0] * MAX_DEPTH
+        self.undoCastling = [0] * MAX_DEPTH
+        self.undoEp = [0] * MAX_DEPTH
+        self.undoHalfmove = [0] * MAX_DEPTH
+        self.undoKey = [0] * MAX_DEPTH
+
+    def putPiece(self, square, piece):
+        bb = BB_SQUARES[square]
+        self.bb[piece] |= bb
+        self.occ[piece >> 3] |= bb
+        self.squares[square] = piece
+
+    def computeKey(self):
+        # polyglot Zobrist key from scratch, equal to polyglot.zobrist_hash(self.toBoard())
+        key = CASTLING_KEYS[self.castling]
+        for square, piece in enumerate(self.squares):
+            if piece:
+                key ^= PIECE_KEYS[piece][square]
+        if self.ep and PAWN_ATTACKS[self.turn ^ 1][self.ep] & self.bb[PAWN | self.turn << 3]:
+            key ^= EP_KEYS[self.ep]
+        if self.turn == WHITE:
+            key ^= TURN_KEY
+        return key
+
+    def toBoard(self):
+        board = chess.Board(None)
+        for square, piece in enumerate(self.squares):
+            if piece:
+                board.set_piece_at(square, chess.Piece(piece & PIECE_MASK, bool(piece >> 3)))
+        board.turn = bool(self.turn)
+        rights = 0
+        for bb, bit in ((chess.BB_H1, WHITE_KINGSIDE), (chess.BB_A1, WHITE_QUEENSIDE),
+                        (chess.BB_H8, BLACK_KINGSIDE), (chess.BB_A8, BLACK_QUEENSIDE)):
+            if self.castling & bit:
+                rights |= bb
+        board.castling_rights = rights
+        board.ep_square = self.ep or None
+        board.halfmove_clock = self.halfmove
+        board.fullmove_number = self.fullmove
+        return board
+
+    def pieceTypeAt(self, square):
+        return self.squares[square] & PIECE_MASK
+
+    def kingSquare(self, color):
+        return SQUARE_OF[self.bb[KING | color << 3]]
+
+    def attacked(self, square, color):
+        # whether a piece of color attacks square
+        bb = self.bb
+        base = color << 3
+        occupied = self.occ[0] | self.occ[1]
+        if KNIGHT_ATTACKS[square] & bb[base | KNIGHT] or KING_ATTACKS[square] & bb[base | KING] or \
+                PAWN_ATTACKS[color ^ 1][square] & bb[base | PAWN]:
+            return True
+        queens = bb[base | QUEEN]
+        if DIAG_ATTACKS[square][DIAG_MASKS[square] & occupied] & (bb[base | BISHOP] | queens):
+            return True
+        return (RANK_ATTACKS[square][RANK_MASKS[square] & occupied] |
+                FILE_ATTACKS[square][FILE_MASKS[square] & occupied]) & (bb[base | ROOK] | queens) != 0
+
+    def inCheck(self):
+        turn = self.turn
+        return self.attacked(SQUARE_OF[self.bb[KING | turn << 3]], turn ^ 1)
+
+    def leftInCheck(self):
+        # after makeMove: whether the move left its own king attacked, i.e. was illegal
+        turn = self.turn
+        return self.attacked(SQUARE_OF[self.bb[KING | (turn ^ 1) << 3]], turn)
+
+    def insufficientMaterial(self):
+        # like board.is_insufficient_material(): no pawns, rooks or queens,
+        # and at most one minor piece or only bishops on one square color
+        bb = self.bb
+        if bb[PAWN] | bb[PAWN | WHITE_PIECE] | bb[ROOK] | bb[ROOK | WHITE_PIECE] | \
+                bb[QUEEN] | bb[QUEEN | WHITE_PIECE]:
+            return False
+        # three pieces or fewer (clearing the lowest three bits leaves none):
+        # the kings and a single minor piece
+        pieces = self.occ[0] | self.occ[1]
+        pieces &= pieces - 1
+        pieces &= pieces - 1
+        if not pieces & (pieces - 1):
+            return True
+        if bb[KNIGHT] | bb[KNIGHT | WHITE_PIECE]:
+            return False
+        bishops = bb[BISHOP] | bb[BISHOP | WHITE_PIECE]
+        return bishops & BB_DARK_SQUARES == 0 or bishops & BB_LIGHT_SQUARES == 0
+
+    def repetitions(self):
+        # how often the current position has occurred, counted like
+        # board.is_fivefold_repetition(): positions before the last capture or
+        # pawn move cannot come back, and the side to move must be the same
+        key = self.key
+        undoKey = self.undoKey
+        history = self.history
+        ply = self.ply
+        count = 1
+        back = 4
+        while back <= self.halfmove and count < 5:
+            index = ply - back
+            if index >= 0:
+                if undoKey[index] == key:
+                    count += 1
+            elif -index <= len(history):
+                if history[index] == key:
+                    count += 1
+            else:
+                break
+            back += 2
+        return count
+
+    def isCapture(self, move):
+        to = move >> 6 & 63
+        return self.squares[to] != 0 or (to == self.ep and self.squares[move & 63] & PIECE_MASK == PAWN)
+
+    def capturedType(self, move):
+        # type of the piece a move takes, 0 if none
+        to = move >> 6 & 63
+        captured = self.squares[to]
+        if captured:
+            return captured & PIECE_MASK
+        if to == self.ep and self.ep and self.squares[move & 63] & PIECE_MASK == PAWN:
+            return PAWN
+        return 0
+
+    def generateMoves(self, quiet=True):
+        # pseudo-legal packed moves; with quiet=False only captures, like
+        # board.generate_legal_captures()
+        moves = []
+        append = moves.append
+        us = self.turn
+        them = us ^ 1
+        bb = self.bb
+        ours = self.occ[us]
+        theirs = self.occ[them]
+        occupied = ours | theirs
+        targets = (BB_ALL & ~ours) if quiet else theirs
+        base = us << 3
+
+        # pawns
+        pawns = bb[base | PAWN]
+        if us == WHITE:
+            single = pawns << 8 & ~occupied
+            double = (single & BB_RANK_3) << 8 & ~occupied
+            left = (pawns & ~BB_FILE_A) << 7 & theirs
+            right = (pawns & ~BB_FILE_H) << 9 & theirs
+            forward, leftDelta, rightDelta = 8, 7, 9
+            lastRank = BB_RANK_8
+        else:
+            single = pawns >> 8 & ~occupied
+            double = (single & BB_RANK_6) >> 8 & ~occupied
+            left = (pawns & ~BB_FILE_A) >> 9 & theirs
+            right = (pawns & ~BB_FILE_H) >> 7 & theirs
+            forward, leftDelta, rightDelta = -8, -9, -7
+            lastRank = BB_RANK_1
+        if not quiet:
+            single = double = 0
+        for targetBB, delta in ((left, leftDelta), (right, rightDelta), (single, forward)):
+            while targetBB:
+                bit = targetBB & -targetBB
+                targetBB ^= bit
+                to = SQUARE_OF[bit]
+                move = (to - delta) | to << 6
+                if bit & lastRank:
+                    append(move | QUEEN << 12)
+                    append(move | KNIGHT << 12)
+                    append(move | ROOK << 12)
+                    append(move | BISHOP << 12)
+                else:
+                    append(move)
+        while double:
+            bit = double & -double
+            double ^= bit
+            to = SQUARE_OF[bit]
+            append((to - 2 * forward) | to << 6)
+        ep = self.ep
+        if ep:
+            attackers = PAWN_ATTACKS[them][ep] & pawns
+            while attackers:
+                bit = attackers & -attackers
+                attackers ^= bit
+                append(SQUARE_OF[bit] | ep << 6)
+
+        # pieces
+        for pieceType in (KNIGHT, BISHOP, ROOK, QUEEN, KING):
+            pieces = bb[base | pieceType]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                square = SQUARE_OF[bit]
+                if pieceType == KNIGHT:
+                    attacks = KNIGHT_ATTACKS[square]
+                elif pieceType == KING:
+                    attacks = KING_ATTACKS[square]
+                else:
+                    attacks = 0
+                    if pieceType != ROOK:
+                        attacks = DIAG_ATTACKS[square][DIAG_MASKS[square] & occupied]
+                    if pieceType != BISHOP:
+                        attacks |= RANK_ATTACKS[square][RANK_MASKS[square] & occupied] | \
+                            FILE_ATTACKS[square][FILE_MASKS[square] & occupied]
+                attacks &= targets
+                while attacks:
+                    bit = attacks & -attacks
+                    attacks ^= bit
+                    append(square | SQUARE_OF[bit] << 6)
+
+        # castling: the king may not start on or pass an attacked square; the
+        # square it lands on is checked like for any other king move
+        castling = self.castling
+        if quiet and castling:
+            if us == WHITE:
+                if castling & WHITE_KINGSIDE and not occupied & (BB_SQUARES[chess.F1] | BB_SQUARES[chess.G1]) and \
+                        not self.attacked(chess.E1, them) and not self.attacked(chess.F1, them):
+                    append(chess.E1 | chess.G1 << 6)
+                if castling & WHITE_QUEENSIDE and \
+                        not occupied & (BB_SQUARES[chess.B1] | BB_SQUARES[chess.C1] | BB_SQUARES[chess.D1]) and \
+                        not self.attacked(chess.E1, them) and not self.attacked(chess.D1, them):
+                    append(chess.E1 | chess.C1 << 6)
+            else:
+                if castling & BLACK_KINGSIDE and not occupied & (BB_SQUARES[chess.F8] | BB_SQUARES[chess.G8]) and \
+                        not self.attacked(chess.E8, them) and not self.attacked(chess.F8, them):
+                    append(chess.E8 | chess.G8 << 6)
+                if castling & BLACK_QUEENSIDE and \
+                        not occupied & (BB_SQUARES[chess.B8] | BB_SQUARES[chess.C8] | BB_SQUARES[chess.D8]) and \
+                        not self.attacked(chess.E8, them) and not self.attacked(chess.D8, them):
+                    append(chess.E8 | chess.C8 << 6)
+        return moves
+
+    def legalMoves(self):
+        moves = []
+        for move in self.generateMoves():
+            self.makeMove(move)
+            if not self.leftInCheck():
+                moves.append(move)
+            self.unmakeMove()
+        return moves
+
+    def hasLegalMove(self):
+        for move in self.generateMoves():
+            self.makeMove(move)
+            legal = not self.leftInCheck()
+            self.unmakeMove()
+            if legal:
+                return True
+        return False
+
+    def makeMove(self, move):
+        ply = self.ply
+        key = self.key
+        ep = self.ep
+        castling = self.castling
+        self.undoMove[ply] = move
+        self.undoCastling[ply] = castling
+        self.undoEp[ply] = ep
+        self.undoHalfmove[ply] = self.halfmove
+        self.undoKey[ply] = key
+        self.ply = ply + 1
+
+        bb = self.bb
+        occ = self.occ
+        squares = self.squares
+        us = self.turn
+        them = us ^ 1
+        self.turn = them
+        key ^= TURN_KEY
+        if us == BLACK:
+            self.fullmove += 1
+        if ep:
+            self.ep = 0
+            if PAWN_ATTACKS[them][ep] & bb[PAWN | us << 3]:
+                key ^= EP_KEYS[ep]
+
+        if move == NULL_MOVE:
+            self.undoCaptured[ply] = 0
+            self.halfmove += 1
+            self.key = key
+            return
+
+        fromSquare = move & 63
+        toSquare = move >> 6 & 63
+        fromBB = BB_SQUARES[fromSquare]
+        toBB = BB_SQUARES[toSquare]
+        piece = squares[fromSquare]
+        captured = squares[toSquare]
+        self.halfmove += 1
+
+        if captured:
+            bb[captured] ^= toBB
+            occ[them] ^= toBB
+            key ^= PIECE_KEYS[captured][toSquare]
+            self.halfmove = 0
+        self.undoCaptured[ply] = captured
+
+        bb[piece] ^= fromBB | toBB
+        occ[us] ^= fromBB | toBB
+        squares[fromSquare] = 0
+        squares[toSquare] = piece
+        key ^= PIECE_KEYS[piece][fromSquare] ^ PIECE_KEYS[piece][toSquare]
+
+        pieceType = piece & PIECE_MASK
+        if pieceType == PAWN:
+            self.halfmove = 0
+            promotion = move >> 12
+            if promotion:
+                promoted = promotion | us << 3
+                bb[piece] ^= toBB
+                bb[promoted] |= toBB
+                squares[toSquare] = promoted
+                key ^= PIECE_KEYS[piece][toSquare] ^ PIECE_KEYS[promoted][toSquare]
+            elif toSquare == ep and ep:
+                # en passant: the captured pawn is behind the target square
+                capturedSquare = toSquare - 8 if us == WHITE else toSquare + 8
+                capturedBB = BB_SQUARES[capturedSquare]
+                enemyPawn = PAWN | them << 3
+                bb[enemyPawn] ^= capturedBB
+                occ[them] ^= capturedBB
+                squares[capturedSquare] = 0
+                key ^= PIECE_KEYS[enemyPawn][capturedSquare]
+                self.undoCaptured[ply] = enemyPawn
+            elif toSquare - fromSquare == 16 or fromSquare - toSquare == 16:
+                ep = (fromSquare + toSquare) >> 1
+                self.ep = ep
+                if PAWN_ATTACKS[us][ep] & bb[PAWN | them << 3]:
+                    key ^= EP_KEYS[ep]
+        elif pieceType == KING and (toSquare - fromSquare == 2 or fromSquare - toSquare == 2):
+            # castling also moves the rook
+            if toSquare > fromSquare:
+                rookFrom, rookTo = fromSquare + 3, fromSquare + 1
+            else:
+                rookFrom, rookTo = fromSquare - 4, fromSquare - 1
+            rook = ROOK | us << 3
+            rookBB = BB_SQUARES[rookFrom] | BB_SQUARES[rookTo]
+            bb[rook] ^= rookBB
+            occ[us] ^= rookBB
+            squares[rookFrom] = 0
+            squares[rookTo] = rook
+            key ^= PIECE_KEYS[rook][rookFrom] ^ PIECE_KEYS[rook][rookTo]
+
+        if castling:
+            rights = castling & CASTLING_MASK[fromSquare] & CASTLING_MASK[toSquare]
+            if rights != castling:
+                self.castling = rights
+                key ^= CASTLING_KEYS[castling] ^ CASTLING_KEYS[rights]
+        self.key = key
+
+    def unmakeMove(self):
+        ply = self.ply - 1
+        self.ply = ply
+        move = self.undoMove[ply]
+        self.castling = self.undoCastling[ply]
+        self.ep = ep = self.undoEp[ply]
+        self.halfmove = self.undoHalfmove[ply]
+        self.key = self.undoKey[ply]
+        us = self.turn ^ 1
+        self.turn = us
+        if us == BLACK:
+            self.fullmove -= 1
+        if move == NULL_MOVE:
+            return
+
+        bb = self.bb
+        occ = self.occ
+        squares = self.squares
+        fromSquare = move & 63
+        toSquare = move >> 6 & 63
+        fromBB = BB_SQUARES[fromSquare]
+        toBB = BB_SQUARES[toSquare]
+        piece = squares[toSquare]
+        if move >> 12:
+            # a promotion: the pawn goes back
+            bb[piece] ^= toBB
+            piece = PAWN | us << 3
+            bb[piece] |= toBB
+        bb[piece] ^= fromBB | toBB
+        occ[us] ^= fromBB | toBB
+        squares[fromSquare] = piece
+        squares[toSquare] = 0
+
+        captured = self.undoCaptured[ply]
+        pieceType = piece & PIECE_MASK
+        if captured:
+            capturedSquare = toSquare
+            if pieceType == PAWN and ep and toSquare == ep:
+                capturedSquare = toSquare - 8 if us == WHITE else toSquare + 8
+            capturedBB = BB_SQUARES[capturedSquare]
+            bb[captured] |= capturedBB
+            occ[us ^ 1] |= capturedBB
+            squares[capturedSquare] = captured
+        elif pieceType == KING and (toSquare - fromSquare == 2 or fromSquare - toSquare == 2):
+            if toSquare > fromSquare:
+                rookFrom, rookTo = fromSquare + 3, fromSquare + 1
+            else:
+                rookFrom, rookTo = fromSquare - 4, fromSquare - 1
+            rook = ROOK | us << 3
+            rookBB = BB_SQUARES[rookFrom] | BB_SQUARES[rookTo]
+            bb[rook] ^= rookBB
+            occ[us] ^= rookBB
+            squares[rookTo] = 0
+            squares[rookFrom] = rook
+
+    def perft(self, depth):
+        # number of legal move sequences of depth plies, to check the move generator
+        if depth == 0:
+            return 1
+        nodes = 0
+        for move in self.generateMoves():
+            self.makeMove(move)
+            if not self.leftInCheck():
+                nodes += self.perft(depth - 1) if depth > 1 else 1
+            self.unmakeMove()
+        return nodes
@@ -78,20 +78,29 @@ class PythonChessMain:
 
         self.Gui = ChessGUI_pygame(1)
         self.ai_players = {}
+        self.threads = options.threads
+        self.ponder = options.ponder
 
     def SetUp(self):
         game_params = TkinterGameSetupParams()
-        (player1Type, player1Depth, player2Type, player2Depth) = game_params.GetGameSetupParams()
+        (player1Type, player1Depth, player1Time,
+         player2Type, player2Depth, player2Time) = game_params.GetGameSetupParams()
+
+        # a move time of 0 means search to the fixed depth
+        player1Time = player1Time if player1Time > 0 else None
+        player2Time = player2Time if player2Time > 0 else None
 
         if player1Type == 'AI':
             if player1Depth > 0:
-                self.ai_players[chess.WHITE] = AI(self.board, chess.WHITE, player1Depth)
+                self.ai_players[chess.WHITE] = AI(self.board, chess.WHITE, player1Depth, moveTime=player1Time,
+                                                  threads=self.threads)
             else:
                 self.ai_players[chess.WHITE] = RandomAI()
 
         if player2Type == 'AI':
             if player2Depth > 0:
-                self.ai_players[chess.BLACK] = AI(self.board, chess.BLACK, player2Depth)
+                self.ai_players[chess.BLACK] = AI(self.board, chess.BLACK, player2Depth, moveTime=player2Time,
+                                                  threads=self.threads)
             else:
                 self.ai_players[chess.BLACK] = RandomAI(self.board)
 
@@ -111,10 +120,15 @@ class PythonChessMain:
             if board.turn in self.ai_players:
                 move = self.ai_players[board.turn].GetNextMove()
             else:
+                # an AI opponent thinks about its reply while the human is choosing
+                ponderer = self.ai_players.get(not board.turn)
+                if self.ponder and isinstance(ponderer, AI):
+                    ponderer.startPondering()
+                else:
+                    ponderer = None
                 move = self.Gui.GetPlayerInput(board)
-                if board.piece_type_at(move.from_square) is chess.PAWN and move.to_square in chess.SquareSet(
-                        chess.BB_RANK_8):
-                    move.promotion = chess.QUEEN
+                if ponderer is not None:
+                    ponderer.stopPondering(move)
 
             # Indicate if piece was captured
             if board.is_capture(move):
@@ -155,15 +169,23 @@ class PythonChessMain:
             self.Gui.EndGame(board)
 
 
-parser = OptionParser()
-parser.add_option("-s", dest="skip_setup",
-                  action="store_true", default=False, help="Skip setup screen")
-
-(options, args) = parser.parse_args()
-
-game = PythonChessMain(options)
-if not options.skip_setup:
-    game.SetUp()
-else:
-    game.ai_players[chess.BLACK] = AI(game.board, chess.BLACK)
-game.MainLoop()
+if __name__ == "__main__":
+    # the guard keeps the AI worker processes from starting a game of their own
+    parser = OptionParser()
+    parser.add_option("-s", dest="skip_setup",
+                      action="store_true", default=False, help="Skip setup screen")
+    parser.add_option("-t", dest="move_time", type="float", default=None,
+                      help="AI time per move in seconds when the setup screen is skipped")
+    parser.add_option("-j", dest="threads", type="int", default=1,
+                      help="Number of worker processes each AI searches with")
+    parser.add_option("-p", dest="ponder", action="store_true", default=False,
+                      help="Let the AI think on the human player's time")
+
+    (options, args) = parser.parse_args()
+
+    game = PythonChessMain(options)
+    if not options.skip_setup:
+        game.SetUp()
+    else:
+        game.ai_players[chess.BLACK] = AI(game.board, chess.BLACK, moveTime=options.move_time, threads=options.threads)
+    game.MainLoop()
@@ -9,12 +9,14 @@
  http://yakinikuman.wordpress.com/
  """
 
+from collections import OrderedDict, deque
+
 import pygame
 from pygame.locals import *
 
 
 class ScrollingTextBox:
-    def __init__(self, screen, xmin, xmax, ymin, ymax):
+    def __init__(self, screen, xmin, xmax, ymin, ymax, historyLines=1000):
         self.screen = screen
         pygame.font.init()
         self.fontDefault = pygame.font.Font(None, 20)
@@ -33,53 +35,94 @@ class ScrollingTextBox:
         self.maxLines = self.yPixLength / self.lineHeight
         # print "Height is",height, "so maxLines is", self.maxLines
 
-        # list of lines starts out empty
-        self.lines = []
+        # ring buffer of the last historyLines lines; the box shows maxLines of
+        # them, scrollOffset lines up from the newest
+        self.lines = deque(maxlen=max(historyLines, self.maxLines))
+        self.scrollOffset = 0
+        # rendered line surfaces by text, least recently drawn first
+        self.rendered = OrderedDict()
+        self.renderedMax = 4 * self.maxLines
+        # set when the visible lines changed since the last Draw
+        self.dirty = True
 
     def AddLine(self, newLine):
         # outside functions shouldn't call this...call Add instead (appropriately breaks up message string into lines)
-        # there can only be "self.maxLines" in the self.lines array
-        #  if textbox is not full, just append the newLine
-        #  if textbox is full, pop a line off from the front and add newLine to the back
-        if len(self.lines) + 1 > self.maxLines:
-            self.lines.pop(0)  # pop(0) pops off beginning; pop() pops off end
+        # the deque drops the oldest line by itself once historyLines is reached;
+        # a new line scrolls the box back to the bottom
         self.lines.append(newLine)
+        self.scrollOffset = 0
+        self.dirty = True
+
+    def FitLength(self, message):
+        # number of leading characters of message that fit on one line,
+        # found by binary search over the prefix length
+        lo = 1
+        hi = len(message)
+        while lo < hi:
+            mid = (lo + hi + 1) / 2
+            if self.fontDefault.size(message[0:mid])[0] <= self.xPixLength:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
 
     def Add(self, message):
         # Break up message string into multiple lines, if necessary
-        (width, height) = self.fontDefault.size(message)
-        remainder = ""
-        if width > self.xPixLength:
-            while width > self.xPixLength:
-                remainder = message[-1] + remainder
-                message = message[0:-1]  # chop off last character
-                (width, height) = self.fontDefault.size(message)
-
-        if len(remainder) > 0:
-            if message[-1].isalnum() and remainder[0].isalnum():
-                remainder = message[-1] + remainder
-                message = message[0:-1] + '-'
-                if message[-2] == ' ':
-                    message = message[0:-1]  # remove the '-'
-
-        self.AddLine(message)
-
-        if len(remainder) > 0:
+        while True:
+            remainder = ""
+            if self.fontDefault.size(message)[0] > self.xPixLength:
+                length = self.FitLength(message)
+                remainder = message[length:]
+                message = message[0:length]
+
+            if len(remainder) > 0:
+                if message[-1].isalnum() and remainder[0].isalnum():
+                    remainder = message[-1] + remainder
+                    message = message[0:-1] + '-'
+                    if message[-2] == ' ':
+                        message = message[0:-1]  # remove the '-'
+
+            self.AddLine(message)
+
             # remove leading spaces
-            while remainder[0] == ' ':
-                remainder = remainder[1:len(remainder)]
-            self.Add(remainder)
+            remainder = remainder.lstrip(' ')
+            if len(remainder) == 0:
+                break
+            message = remainder
+
+    def Scroll(self, lines):
+        # positive scrolls back into the history, negative towards the newest line
+        offset = max(0, min(self.scrollOffset + lines, len(self.lines) - self.maxLines))
+        if offset != self.scrollOffset:
+            self.scrollOffset = offset
+            self.dirty = True
+
+    def RenderLine(self, line):
+        surface = self.rendered.pop(line, None)
+        if surface is None:
+            color = (255, 255, 255)  # white
+            antialias = 1  # evidently, for some people rendering text fails when antialiasing is off
+            surface = self.fontDefault.render(line, antialias, color)
+            if len(self.rendered) >= self.renderedMax:
+                self.rendered.popitem(last=False)
+        self.rendered[line] = surface
+        return surface
 
     def Draw(self):
-        # Draw all lines
+        # Draw the visible lines over a cleared box
+        self.screen.fill((0, 0, 0), self.GetRect())
         xpos = self.xmin
         ypos = self.ymin
-        color = (255, 255, 255)  # white
-        antialias = 1  # evidently, for some people rendering text fails when antialiasing is off
-        for line in self.lines:
-            renderedLine = self.fontDefault.render(line, antialias, color)
-            self.screen.blit(renderedLine, (xpos, ypos))
+        last = len(self.lines) - self.scrollOffset
+        first = max(0, last - self.maxLines)
+        for i in range(first, last):
+            self.screen.blit(self.RenderLine(self.lines[i]), (xpos, ypos))
             ypos = ypos + self.lineHeight
+        self.dirty = False
+
+    def GetRect(self):
+        # screen area the text box draws in
+        return pygame.Rect(self.xmin, self.ymin, self.xPixLength, self.yPixLength)
 
 
 if __name__ == "__main__":
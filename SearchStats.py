@@ -0,0 +1,92 @@
+"""
+ Project: Python Chess
+ File name: SearchStats.py
+ Description:  Optional counters filled in by the AI search, to find out
+	where the time of a slow move goes: nodes, quiescence nodes, leaf
+	evaluations, game-over leaves, tablebase hits, beta cutoffs by the
+	index of the move that caused them, transposition table probes and
+	hits, and the nodes and time of every iteration.  An engine built with stats=True keeps
+	one SearchStats, reset at the start of each move; with stats off the
+	search only pays for an "is not None" test at the counted places.
+ """
+
+import json
+import logging
+import timeit
+
+# cutoffs on the move at index CUTOFF_SLOTS - 1 or later share the last slot
+CUTOFF_SLOTS = 16
+
+
+class SearchStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self, fen=None, ttCounters=None):
+        # called when a search starts; ttCounters are the table's counters then
+        self.fen = fen
+        self.move = None
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.leafEvals = 0
+        self.terminals = 0
+        self.tablebaseHits = 0
+        self.cutoffs = [0] * CUTOFF_SLOTS
+        self.ttStart = dict(ttCounters or {})
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.iterations = []
+        self.startTime = timeit.default_timer()
+        self.time = 0.0
+
+    def cutoff(self, index):
+        self.cutoffs[min(index, CUTOFF_SLOTS - 1)] += 1
+
+    def endIteration(self, depth, nodes):
+        # nodes and seconds count from the start of the search
+        seconds = timeit.default_timer() - self.startTime
+        iteration = {'depth': depth, 'nodes': nodes, 'time': seconds,
+                     'depthNodes': nodes, 'depthTime': seconds}
+        if self.iterations:
+            previous = self.iterations[-1]
+            iteration['depthNodes'] = nodes - previous['nodes']
+            iteration['depthTime'] = seconds - previous['time']
+            # effective branching factor: growth of the tree from one depth to the next
+            iteration['branching'] = iteration['depthNodes'] / float(max(previous['depthNodes'], 1))
+        self.iterations.append(iteration)
+
+    def finish(self, move, nodes, ttCounters):
+        self.move = move.uci() if move else None
+        self.nodes = nodes
+        self.time = timeit.default_timer() - self.startTime
+        self.ttProbes = ttCounters['probes'] - self.ttStart.get('probes', 0)
+        self.ttHits = ttCounters['hits'] - self.ttStart.get('hits', 0)
+
+    def firstMoveCutoffRate(self):
+        # share of the beta cutoffs caused by the first move, a measure of move ordering
+        total = sum(self.cutoffs)
+        return self.cutoffs[0] / float(total) if total else 0.0
+
+    def toDict(self):
+        return {'fen': self.fen,
+                'move': self.move,
+                'nodes': self.nodes,
+                'quiescenceNodes': self.quiescenceNodes,
+                'leafEvals': self.leafEvals,
+                'terminals': self.terminals,
+                'tablebaseHits': self.tablebaseHits,
+                'cutoffs': list(self.cutoffs),
+                'firstMoveCutoffRate': self.firstMoveCutoffRate(),
+                'ttProbes': self.ttProbes,
+                'ttHits': self.ttHits,
+                'time': self.time,
+                'nps': self.nodes / self.time if self.time > 0 else 0.0,
+                'iterations': list(self.iterations)}
+
+    def toJSON(self):
+        return json.dumps(self.toDict(), sort_keys=True)
+
+    def log(self, logger=None, level=logging.INFO):
+        # one structured record per move
+        logger = logger or logging.getLogger('search')
+        logger.log(level, 'search %s', self.toJSON(), extra={'searchStats': self.toDict()})
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+"""
+ Project: Python Chess
+ File name: SelfPlay.py
+ Description:  Headless AI vs. AI tournament runner.  Plays a batch of
+	games between two engine configurations across worker processes,
+	spreading the openings with the polyglot book, and writes every game
+	(moves, result, per-move timings and node counts) as one JSON line.
+	Prints games per hour, nodes per second and an Elo difference
+	estimate at the end.  Run with "-h" for the list of options.
+
+	An engine given "stats=True" adds its search statistics for every
+	move to the records.
+
+	Example:
+	  python SelfPlay.py -n 40 -j 8 -a "ply=3" -b "ply=3,pieceSquareTables=True"
+ """
+
+import ast
+import json
+import math
+import multiprocessing
+import random
+import timeit
+from optparse import OptionParser
+
+import chess
+
+from AI import AI
+from OpeningBook import getBook, BOOK_PATH
+
+
+def parseConfig(text):
+    # "ply=3,quiescence=False" -> {'ply': 3, 'quiescence': False}
+    config = {}
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, value = item.split('=', 1)
+        config[name.strip()] = ast.literal_eval(value.strip())
+    # pool workers are daemonic and may not start a pool of their own
+    config['threads'] = 1
+    # the openings are spread by playOpening; the engines search from there
+    config.setdefault('bookPath', None)
+    return config
+
+
+def playOpening(board, rng, plies, bookPath):
+    # weighted book moves while the book knows the position, seeded random
+    # legal moves after that, so that every game starts differently
+    book = getBook(bookPath) if bookPath else None
+    for i in range(plies):
+        if board.is_game_over():
+            break
+        move = None
+        if book is not None:
+            move = book.choose(board, 'weighted', rng)
+            if move is None:
+                book = None
+        if move is None:
+            move = rng.choice(list(board.legal_moves))
+        board.push(move)
+
+
+def playGame(task):
+    # runs in a worker process; returns the game record
+    index, whiteName, whiteConfig, blackName, blackConfig, seed, openingPlies, bookPath, maxMoves = task
+    board = chess.Board()
+    playOpening(board, random.Random(seed), openingPlies, bookPath)
+    opening = [move.uci() for move in board.move_stack]
+
+    engines = {chess.WHITE: AI(board, chess.WHITE, **whiteConfig),
+               chess.BLACK: AI(board, chess.BLACK, **blackConfig)}
+    times = []
+    nodes = []
+    depths = []
+    stats = []
+    while not board.is_game_over() and board.fullmove_number <= maxMoves:
+        engine = engines[board.turn]
+        start = timeit.default_timer()
+        move = engine.GetNextMove()
+        times.append(timeit.default_timer() - start)
+        nodes.append(engine.nodes)
+        depths.append(engine.depthReached)
+        if engine.stats is not None:
+            stats.append(engine.stats.toDict())
+        board.push(move)
+
+    # games that reach maxMoves are adjudicated as draws
+    result = board.result() if board.is_game_over() else '1/2-1/2'
+    record = {'game': index,
+              'white': whiteName,
+              'black': blackName,
+              'result': result,
+              'opening': opening,
+              'moves': [move.uci() for move in board.move_stack],
+              'times': times,
+              'nodes': nodes,
+              'depths': depths}
+    if stats:
+        record['stats'] = stats
+    return record
+
+
+def eloDifference(wins, draws, losses):
+    # Elo difference and its 95% error margin from a win/draw/loss count
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, float('inf')
+    score = (wins + 0.5 * draws) / float(games)
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def elo(s):
+        s = min(max(s, 1e-6), 1 - 1e-6)
+        return -400.0 * math.log10(1.0 / s - 1.0)
+
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2.0
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", dest="games", type="int", default=10, help="Number of games")
+    parser.add_option("-j", dest="workers", type="int", default=multiprocessing.cpu_count(),
+                      help="Number of games played at the same time")
+    parser.add_option("-a", dest="engine_a", default="ply=3", help="Options of engine A, e.g. \"ply=3\"")
+    parser.add_option("-b", dest="engine_b", default="ply=3", help="Options of engine B")
+    parser.add_option("--book", dest="book", default=BOOK_PATH, help="Polyglot book for the openings")
+    parser.add_option("--opening-plies", dest="opening_plies", type="int", default=8,
+                      help="Plies played from the book (or at random) before the engines take over")
+    parser.add_option("--max-moves", dest="max_moves", type="int", default=150,
+                      help="Adjudicate a draw after this many moves")
+    parser.add_option("--seed", dest="seed", type="int", default=1, help="Seed for the openings")
+    parser.add_option("-o", dest="output", default="selfplay.jsonl", help="File the game records go to")
+    (options, args) = parser.parse_args()
+
+    configA = parseConfig(options.engine_a)
+    configB = parseConfig(options.engine_b)
+
+    # each opening is played twice with colors reversed
+    tasks = []
+    for i in range(options.games):
+        seed = options.seed + i // 2
+        if i % 2 == 0:
+            tasks.append((i, 'A', configA, 'B', configB, seed, options.opening_plies, options.book, options.max_moves))
+        else:
+            tasks.append((i, 'B', configB, 'A', configA, seed, options.opening_plies, options.book, options.max_moves))
+
+    wins = draws = losses = 0
+    totalNodes = 0
+    totalTime = 0.0
+    start = timeit.default_timer()
+    pool = multiprocessing.Pool(options.workers)
+    output = open(options.output, 'w')
+    try:
+        for record in pool.imap_unordered(playGame, tasks):
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+            totalNodes += sum(record['nodes'])
+            totalTime += sum(record['times'])
+
+            if record['result'] == '1/2-1/2':
+                draws += 1
+            elif (record['result'] == '1-0') == (record['white'] == 'A'):
+                wins += 1
+            else:
+                losses += 1
+            print 'game %d: %s (A as %s)  A +%d =%d -%d' % (
+                record['game'], record['result'], 'white' if record['white'] == 'A' else 'black',
+                wins, draws, losses)
+    finally:
+        output.close()
+        pool.close()
+        pool.join()
+
+    elapsed = timeit.default_timer() - start
+    elo, margin = eloDifference(wins, draws, losses)
+    print
+    print 'A: %s' % options.engine_a
+    print 'B: %s' % options.engine_b
+    print 'A +%d =%d -%d' % (wins, draws, losses)
+    print 'Elo difference A - B: %+.1f +/- %.1f' % (elo, margin)
+    print 'games per hour: %.1f' % (options.games * 3600.0 / elapsed)
+    print 'nodes per second: %.0f' % (totalNodes / totalTime if totalTime else 0)
+    print 'records written to %s' % options.output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+ Project: Python Chess
+ File name: Tablebase.py
+ Description:  Process-wide Syzygy endgame tablebase service.  The tables
+	of a directory are opened once per process and shared by every engine
+	in it.  Win/draw/loss probes are kept in a least recently used cache,
+	since the search meets the same endgame positions again and again.
+	Without the directory, or without a table for the material on the
+	board, every probe simply misses.
+
+	WDL values are from the side to move's point of view: 2 win, 1 win
+	that the 50-move rule turns into a draw, 0 draw, -1 loss saved by the
+	50-move rule, -2 loss.
+ """
+
+import atexit
+import os
+from collections import OrderedDict
+
+import chess
+import chess.syzygy
+
+TABLEBASE_PATH = os.path.join('data', 'syzygy')
+# probes remembered per directory
+CACHE_SIZE = 1 << 16
+
+# open tablebases by absolute path
+_tablebases = {}
+
+
+class Tablebase:
+    def __init__(self, path, cacheSize=CACHE_SIZE):
+        self.path = path
+        self.tables = None
+        if os.path.isdir(path):
+            self.tables = chess.syzygy.open_tablebases(path)
+        # WDL by position key, least recently used first; misses are
+        # cached as None, so that a missing table is looked for only once
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+
+    def covers(self, board, maxPieces):
+        # whether board may be in the tables: none has castling rights
+        return self.tables is not None and not board.castling_rights and \
+            chess.popcount(board.occupied) <= maxPieces
+
+    def probeWdl(self, position):
+        # WDL of a search Position, or None if it is not in the tables; it is
+        # only turned into a chess.Board when the cache misses
+        if self.tables is None:
+            return None
+        cache = self.cache
+        key = position.key
+        if key in cache:
+            wdl = cache.pop(key)
+        else:
+            wdl = self.tables.get_wdl(position.toBoard())
+            if len(cache) >= self.cacheSize:
+                cache.popitem(last=False)
+        cache[key] = wdl
+        return wdl
+
+    def rootMove(self, board):
+        # the tablebase move for board, or None if the position or its DTZ
+        # tables are missing.  A win is played towards the next capture or
+        # pawn move as fast as possible, so that the 50-move rule cannot
+        # save the opponent; a loss is dragged out as long as possible
+        tables = self.tables
+        bestMove = None
+        bestRank = None
+        for move in board.legal_moves:
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            try:
+                if board.is_checkmate():
+                    return move
+                # the opponent's view of the position after the move
+                wdl = -tables.probe_wdl(board)
+                dtz = -tables.probe_dtz(board)
+            except KeyError:
+                return None
+            finally:
+                board.pop()
+            if wdl > 0:
+                rank = (wdl, zeroing, -abs(dtz))
+            elif wdl < 0:
+                rank = (wdl, False, abs(dtz))
+            else:
+                rank = (wdl, False, 0)
+            if bestRank is None or rank > bestRank:
+                bestRank = rank
+                bestMove = move
+        return bestMove
+
+    def close(self):
+        if self.tables is not None:
+            self.tables.close()
+            self.tables = None
+        self.cache.clear()
+
+
+def getTablebase(path=TABLEBASE_PATH):
+    path = os.path.abspath(path)
+    if path not in _tablebases:
+        _tablebases[path] = Tablebase(path)
+    return _tablebases[path]
+
+
+def closeTablebases():
+    for tablebase in _tablebases.values():
+        tablebase.close()
+    _tablebases.clear()
+
+
+atexit.register(closeTablebases)
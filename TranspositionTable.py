@@ -0,0 +1,249 @@
+"""
+ Project: Python Chess
+ File name: TranspositionTable.py
+ Description:  Fixed-size transposition table used by the AI search.
+	Positions are keyed by their polyglot Zobrist hash.  Each slot holds
+	(key, depth, score, bound, best move, age); when two positions collide
+	the deeper result, or the result from the current search, is kept.
+
+	SharedTranspositionTable keeps the slots in a memory-mapped file
+	instead, shared by every engine process that opens it and kept across
+	restarts, so a new engine starts with what earlier ones searched.
+ """
+
+import hashlib
+import mmap
+import os
+import struct
+
+import chess
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# bound types of a stored score
+EXACT = 0
+LOWERBOUND = 1
+UPPERBOUND = 2
+
+# indices into an entry tuple
+KEY = 0
+DEPTH = 1
+SCORE = 2
+BOUND = 3
+MOVE = 4
+AGE = 5
+
+# rough size of one filled slot (tuple + ints, the move packed into one),
+# used to turn a megabyte budget into a slot count
+ENTRY_BYTES = 160
+
+
+class TranspositionTable:
+    def __init__(self, sizeMB=16):
+        self.resize(sizeMB)
+
+    def resize(self, sizeMB):
+        # the slot count is rounded down to a power of two so that the index
+        # is a mask instead of a modulo
+        slots = max(1, int(sizeMB * 1024 * 1024) // ENTRY_BYTES)
+        size = 1
+        while size * 2 <= slots:
+            size *= 2
+        self.size = size
+        self.mask = size - 1
+        self.clear()
+
+    def clear(self):
+        self.table = [None] * self.size
+        self.age = 0
+        self.filled = 0
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.probes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.replacements = 0
+
+    def newSearch(self):
+        # entries left over from older searches lose their depth priority
+        self.age = (self.age + 1) & 0xff
+
+    def setPlayer(self, player):
+        # the draw scores depend on the engine's side; a private table is
+        # cleared by the caller instead when the side changes
+        pass
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.table[key & self.mask]
+        if entry is not None and entry[KEY] == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        index = key & self.mask
+        old = self.table[index]
+        if old is None:
+            self.filled += 1
+        elif old[KEY] != key:
+            if old[AGE] == self.age and old[DEPTH] > depth:
+                # depth-preferred: keep a deeper result from the current search
+                return
+            self.replacements += 1
+        elif move is None:
+            # keep the best move of a previous search of this position
+            move = old[MOVE]
+        self.stores += 1
+        self.table[index] = (key, depth, score, bound, move, self.age)
+
+    def hashfull(self):
+        # permille of slots in use
+        return self.filled * 1000 // self.size
+
+    def stats(self):
+        return {'size': self.size,
+                'probes': self.probes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'replacements': self.replacements,
+                'hashfull': self.hashfull()}
+
+
+# shared table file: a header of HEADER_BYTES, then SLOT.size bytes per slot
+TABLE_MAGIC = 'PYCHESTT'
+# raised whenever the file layout changes; older files are then rebuilt
+TABLE_VERSION = 1
+HEADER = struct.Struct('<8sIQQ')  # magic, version, slot count, signature
+HEADER_BYTES = 64
+SLOT = struct.Struct('<QQ')  # key ^ data, data
+# data word: move 15 bits, bound 2, depth 8, age 8, score 30, in-use flag
+SCORE_OFFSET = 1 << 29
+IN_USE = 1 << 63
+# mixed into the keys of the positions searched for Black
+PLAYER_SALT = 0x5d2c8f3a9b1e4c67
+# slots sampled by hashfull()
+HASHFULL_SAMPLE = 1000
+
+
+class SharedTranspositionTable(TranspositionTable):
+    # Slots are read and written without locks.  A slot holds its data
+    # word and the key xor the data, so a slot that two processes wrote at
+    # the same time no longer matches any key and reads as a miss.  The
+    # file header names the layout version and a signature of the
+    # evaluation (anything that changes the scores); a file from another
+    # version is rebuilt, and one from another signature is cleared, so
+    # engines that share a file should share their evaluation settings
+    def __init__(self, path, sizeMB=16, signature=''):
+        self.path = path
+        self.signature = struct.unpack('<Q', hashlib.md5(signature).digest()[:8])[0]
+        self.map = None
+        self.salt = 0
+        TranspositionTable.__init__(self, sizeMB)
+
+    def resize(self, sizeMB):
+        # opens the file; sizeMB only applies when the file is created or
+        # rebuilt, a valid file keeps its size since other processes may
+        # have it mapped
+        slots = max(1, int(sizeMB * 1024 * 1024) // SLOT.size)
+        size = 1
+        while size * 2 <= slots:
+            size *= 2
+        self.close()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            header = os.read(fd, HEADER.size)
+            valid = False
+            if len(header) == HEADER.size:
+                magic, version, fileSize, signature = HEADER.unpack(header)
+                valid = magic == TABLE_MAGIC and version == TABLE_VERSION and fileSize > 0 and \
+                    fileSize & (fileSize - 1) == 0 and \
+                    os.fstat(fd).st_size == HEADER_BYTES + fileSize * SLOT.size
+            if valid:
+                size = fileSize
+            else:
+                # a new file, or one of another layout: all zeros is empty
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, HEADER_BYTES + size * SLOT.size)
+            self.map = mmap.mmap(fd, HEADER_BYTES + size * SLOT.size)
+            self.size = size
+            self.mask = size - 1
+            if valid and signature != self.signature:
+                self.wipe()
+            if not valid or signature != self.signature:
+                HEADER.pack_into(self.map, 0, TABLE_MAGIC, TABLE_VERSION, size, self.signature)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            # the map keeps a descriptor of its own
+            os.close(fd)
+        self.age = 0
+        self.resetCounters()
+
+    def wipe(self):
+        block = '\0' * (1 << 20)
+        end = HEADER_BYTES + self.size * SLOT.size
+        for offset in xrange(HEADER_BYTES, end, len(block)):
+            self.map[offset:min(offset + len(block), end)] = block[:end - offset]
+
+    def clear(self):
+        # empties the file for every process that shares it
+        self.wipe()
+        self.age = 0
+        self.resetCounters()
+
+    def setPlayer(self, player):
+        # the positions searched for each side are kept apart
+        self.salt = 0 if player == chess.WHITE else PLAYER_SALT
+
+    def probe(self, key):
+        self.probes += 1
+        salted = key ^ self.salt
+        check, data = SLOT.unpack_from(self.map, HEADER_BYTES + (salted & self.mask) * SLOT.size)
+        if data and check ^ data == salted:
+            self.hits += 1
+            return (key, int(data >> 17 & 0xff), int((data >> 33 & 0x3fffffff) - SCORE_OFFSET), int(data >> 15 & 3),
+                    int(data & 0x7fff) or None, int(data >> 25 & 0xff))
+        self.misses += 1
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        key ^= self.salt
+        offset = HEADER_BYTES + (key & self.mask) * SLOT.size
+        check, data = SLOT.unpack_from(self.map, offset)
+        if data and check ^ data == key:
+            if move is None:
+                # keep the best move of a previous search of this position
+                move = int(data & 0x7fff) or None
+        elif data:
+            if data >> 25 & 0xff == self.age and data >> 17 & 0xff > depth:
+                # depth-preferred: keep a deeper result from the current search
+                return
+            self.replacements += 1
+        self.stores += 1
+        data = (move or 0) | bound << 15 | min(depth, 0xff) << 17 | self.age << 25 | \
+            min(max(score + SCORE_OFFSET, 0), 0x3fffffff) << 33 | IN_USE
+        SLOT.pack_into(self.map, offset, key ^ data, data)
+
+    def hashfull(self):
+        # permille of slots in use, sampled from the start of the file
+        sample = min(self.size, HASHFULL_SAMPLE)
+        used = 0
+        for index in xrange(sample):
+            if SLOT.unpack_from(self.map, HEADER_BYTES + index * SLOT.size)[1]:
+                used += 1
+        return used * 1000 // sample
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
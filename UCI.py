@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+"""
+ Project: Python Chess
+ File name: UCI.py
+ Description:  Universal Chess Interface front-end for the AI engine, so
+	that it can be run by tournament managers and chess GUIs or played
+	against other engines.  Talks UCI on stdin/stdout.  The search runs
+	in its own thread, which keeps the engine responsive to "stop",
+	"isready" and "quit" while it thinks.
+
+	Supported: uci, isready, ucinewgame, setoption (Hash, Threads,
+	SyzygyPath, SyzygyProbeLimit),
+	position (startpos/fen, moves), go (wtime, btime, winc, binc,
+	movestogo, movetime, depth, nodes, infinite), stop, quit.
+
+	Example:
+	  python UCI.py
+ """
+
+import multiprocessing
+import sys
+import threading
+
+import chess
+
+from AI import AI
+
+ENGINE_NAME = 'Python Chess'
+ENGINE_AUTHOR = 'Steve Osborne, kokoff'
+
+DEFAULT_HASH = 16
+MAX_HASH = 1024
+DEFAULT_TABLEBASE_PIECES = 5
+MAX_TABLEBASE_PIECES = 7
+# milliseconds kept back from every move for the GUI and the process to
+# react, and the number of moves a game clock is assumed to last for
+MOVE_OVERHEAD = 50
+MOVES_TO_GO = 30
+# engine scores are in tenths of a pawn
+CENTIPAWNS = 10
+
+
+class UCIEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.hashSize = DEFAULT_HASH
+        self.threads = 1
+        self.tablebasePath = None
+        self.tablebasePieces = DEFAULT_TABLEBASE_PIECES
+        self.board = chess.Board()
+        self.ai = None
+        self.searchThread = None
+        # set by "stop"/"quit": an infinite search may only report its move then
+        self.stopRequested = threading.Event()
+        self.newGame()
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def newGame(self):
+        self.ai = AI(self.board, self.board.turn, hashSize=self.hashSize, threads=self.threads,
+                     tablebasePath=self.tablebasePath, tablebasePieces=self.tablebasePieces)
+        self.ai.infoCallback = self.sendInfo
+        # the search checks the event itself, so a stop that comes before the
+        # search thread is under way is not lost
+        self.ai.stopEvent = self.stopRequested
+
+    def run(self, input=sys.stdin):
+        for line in iter(input.readline, ''):
+            if not self.handle(line):
+                break
+        self.stopSearch()
+
+    def handle(self, line):
+        # runs one command; returns False on "quit"
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send('id name %s' % ENGINE_NAME)
+            self.send('id author %s' % ENGINE_AUTHOR)
+            self.send('option name Hash type spin default %d min 1 max %d' % (DEFAULT_HASH, MAX_HASH))
+            self.send('option name Threads type spin default 1 min 1 max %d' % multiprocessing.cpu_count())
+            self.send('option name SyzygyPath type string default <empty>')
+            self.send('option name SyzygyProbeLimit type spin default %d min 0 max %d' % (
+                DEFAULT_TABLEBASE_PIECES, MAX_TABLEBASE_PIECES))
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.stopSearch()
+            self.board = chess.Board()
+            self.newGame()
+        elif command == 'setoption':
+            self.stopSearch()
+            self.setOption(args)
+        elif command == 'position':
+            self.stopSearch()
+            self.setPosition(args)
+        elif command == 'go':
+            self.stopSearch()
+            self.go(args)
+        elif command == 'stop':
+            self.stopSearch()
+        elif command == 'quit':
+            return False
+        # anything else (debug, register, ponderhit, ...) is ignored, as UCI asks
+        return True
+
+    def setOption(self, args):
+        # setoption name <name> value <value>
+        if 'name' not in args or 'value' not in args:
+            return
+        name = ' '.join(args[args.index('name') + 1:args.index('value')]).lower()
+        text = ' '.join(args[args.index('value') + 1:])
+        if name == 'syzygypath':
+            # a new engine, since pool workers take the tables from their options
+            self.tablebasePath = text if text and text != '<empty>' else None
+            self.newGame()
+            return
+        try:
+            value = int(text)
+        except ValueError:
+            return
+        if name == 'syzygyprobelimit':
+            self.tablebasePieces = min(max(value, 0), MAX_TABLEBASE_PIECES)
+            self.ai.tablebasePieces = self.tablebasePieces
+            self.ai.workerOptions['tablebasePieces'] = self.tablebasePieces
+        elif name == 'hash':
+            self.hashSize = min(max(value, 1), MAX_HASH)
+            self.ai.tt.resize(self.hashSize)
+            self.ai.workerOptions['hashSize'] = self.hashSize
+        elif name == 'threads':
+            self.threads = max(value, 1)
+            self.ai.threads = self.threads
+
+    def setPosition(self, args):
+        # position [startpos | fen <fen>] [moves <move> ...]
+        moves = []
+        if 'moves' in args:
+            moves = args[args.index('moves') + 1:]
+            args = args[:args.index('moves')]
+        try:
+            if args and args[0] == 'fen':
+                board = chess.Board(' '.join(args[1:]))
+            else:
+                board = chess.Board()
+            for uci in moves:
+                board.push_uci(uci)
+        except ValueError:
+            self.send('info string invalid position')
+            return
+        self.board = board
+
+    def go(self, args):
+        options = {}
+        for i, word in enumerate(args):
+            if word in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes'):
+                try:
+                    options[word] = int(args[i + 1])
+                except (IndexError, ValueError):
+                    pass
+        infinite = 'infinite' in args
+
+        ai = self.ai
+        board = self.board
+        if board.turn != ai.player:
+            # stored scores are from the point of view of the engine's side
+            ai.tt.clear()
+        ai.board = board
+        ai.player = board.turn
+        ai.inBook = ai.book is not None and not infinite
+        ai.ply = options.get('depth', AI.MAX_PLY) - 1
+        ai.fixedDepth = 'depth' in options
+        ai.moveTime = self.moveTime(board.turn, options)
+        ai.nodeLimit = options.get('nodes')
+
+        self.stopRequested.clear()
+        self.searchThread = threading.Thread(target=self.search, args=(infinite,))
+        self.searchThread.daemon = True
+        self.searchThread.start()
+
+    def moveTime(self, color, options):
+        # seconds to spend on this move, or None to search without a clock
+        if 'movetime' in options:
+            return max(options['movetime'] - MOVE_OVERHEAD, 1) / 1000.0
+        clock = options.get('wtime' if color == chess.WHITE else 'btime')
+        if clock is None:
+            return None
+        increment = options.get('winc' if color == chess.WHITE else 'binc', 0)
+        share = clock / max(options.get('movestogo', MOVES_TO_GO), 1) + increment * 3 // 4
+        # never more than half the clock
+        share = min(share, clock // 2)
+        return max(share - MOVE_OVERHEAD, 1) / 1000.0
+
+    def search(self, infinite):
+        ai = self.ai
+        board = self.board
+        move = None
+        if not board.is_game_over():
+            move = ai.getOpening()
+            if move is None and not infinite:
+                move = ai.getTablebaseMove()
+            if move is None:
+                move = ai.getMinimaxMove()
+        if infinite:
+            # UCI wants the move of an infinite search only after "stop"
+            self.stopRequested.wait()
+        self.send('bestmove %s' % (move.uci() if move else '0000'))
+
+    def sendInfo(self, depth, score, nodes, seconds):
+        pv = self.ai.principalVariation(self.ai.board)
+        self.send('info depth %d score cp %d nodes %d nps %d time %d pv %s' % (
+            depth, score * CENTIPAWNS, nodes, nodes / max(seconds, 1e-3), seconds * 1000,
+            ' '.join(move.uci() for move in pv)))
+
+    def stopSearch(self):
+        # interrupts a running search and waits for its bestmove
+        if self.searchThread is None:
+            return
+        self.stopRequested.set()
+        self.ai.stop()
+        self.searchThread.join()
+        self.searchThread = None
+
+
+def main():
+    UCIEngine().run()
+
+
+if __name__ == '__main__':
+    main()